@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : benchmark_concurrency
+# @Software       : PyCharm
+
+'''
+并发参数压测
+
+在本地模拟阿里云接口（每次请求注入固定延迟，另按返回条数增加延迟），
+按并发数、页大小、区域数组合压测五个采集类，输出各资源的吞吐量曲线及最优配置
+
+用法：
+python benchmark_concurrency.py
+python benchmark_concurrency.py --resources ecs,rds --workers 1,8,32 --regions 1,8 --latency 0.05 --json result.json
+'''
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+from itertools import product
+
+from settings import Settings
+from get_all_ecs import ECS
+from get_all_rds import RDS
+from get_all_domains import Domain
+from get_all_records import Record
+from get_all_regions import REGION
+
+logger = logging
+
+# 压测的页大小，不超过各接口允许的最大值
+PAGE_SIZES = {
+    'ecs': (10, 50, 100),
+    'disk': (10, 50, 100),
+    'rds': (10, 50, 100),
+    'domain': (10, 20, 50),
+    'record': (20, 100, 500),
+}
+
+# 按区域采集的资源，其余资源只压测一种区域数
+REGIONAL = ('ecs', 'disk', 'rds')
+
+
+class MockClient:
+    '''
+    模拟 AcsClient，按请求的 Action 和分页参数生成数据
+    '''
+
+    def __init__(self, api, region_id):
+        self.api = api
+        self.region_id = region_id
+
+    def get_region_id(self):
+        return self.region_id
+
+    def get_access_key(self):
+        return 'mock'
+
+    def do_action_with_exception(self, request):
+        action = request.get_action_name()
+        params = request.get_query_params()
+        data, items = getattr(self.api, 'action_' + action)(self.region_id, params)
+        time.sleep(self.api.latency + random.uniform(0, self.api.jitter) + self.api.item_latency * items)
+        return json.dumps(data).encode('utf-8')
+
+
+class MockApi:
+    '''
+    模拟接口，作为 Settings.client_factory 使用
+
+    :param regions: 区域数
+    :param per_region: 每个区域的ECS、硬盘数，RDS数为其1/5
+    :param domains: 域名数
+    :param records: 每个域名的解析记录数
+    :param latency: 每次请求的延迟（秒）
+    :param item_latency: 每返回一条数据增加的延迟（秒）
+    :param jitter: 每次请求随机增加 0~jitter 秒的延迟
+    '''
+
+    def __init__(self, regions=4, per_region=500, domains=200, records=1000, latency=0.02, item_latency=0.0002,
+                 jitter=0.0):
+        self.regions = ['mock-region-%d' % i for i in range(regions)]
+        self.per_region = per_region
+        self.domains = domains
+        self.records = records
+        self.latency = latency
+        self.item_latency = item_latency
+        self.jitter = jitter
+
+    def __call__(self, access_key, secret, region_id):
+        return MockClient(self, region_id)
+
+    @staticmethod
+    def page(total, params, number_key='PageNumber'):
+        size = int(params['PageSize'])
+        start = (int(params[number_key]) - 1) * size
+        return range(start, min(start + size, total))
+
+    def action_DescribeRegions(self, region, params):
+        return {'Regions': {'Region': [{'RegionId': r} for r in self.regions]}}, len(self.regions)
+
+    def action_DescribeInstances(self, region, params):
+        page = self.page(self.per_region, params)
+        instances = [{
+            'InstanceId': 'i-%s-%d' % (region, i),
+            'InstanceName': 'instance-%d' % i,
+            'HostName': 'host-%d' % i,
+            'Description': '',
+            'NetworkInterfaces': {'NetworkInterface': [
+                {'PrimaryIpAddress': '10.0.%d.%d' % (i // 250, i % 250), 'MacAddress': '00:16:3e:00:%02x:%02x' % (i // 256, i % 256)}]},
+            'PublicIpAddress': {'IpAddress': ['47.0.%d.%d' % (i // 250, i % 250)]},
+            'OSNameEn': 'CentOS 7.6 64 bit',
+            'OSType': 'linux',
+            'Cpu': 2,
+            'Memory': 4096,
+            'SerialNumber': 'sn-%d' % i,
+            'CreationTime': '2019-01-01T00:00Z',
+            'ExpiredTime': '2020-%02d-01T16:00Z' % (i % 12 + 1),
+            'ZoneId': region + '-a',
+            'RegionId': region,
+            'Status': 'Running',
+            'InstanceChargeType': 'PrePaid',
+            'InternetChargeType': 'PayByTraffic',
+            'InstanceType': 'ecs.g5.large',
+            'InstanceTypeFamily': 'ecs.g5',
+        } for i in page]
+        return {'TotalCount': self.per_region, 'Instances': {'Instance': instances}}, len(instances)
+
+    def action_DescribeDisks(self, region, params):
+        page = self.page(self.per_region, params)
+        disks = [{'DiskId': 'd-%s-%d' % (region, i), 'Size': 40, 'RegionId': region} for i in page]
+        return {'TotalCount': self.per_region, 'Disks': {'Disk': disks}}, len(disks)
+
+    def action_DescribeDBInstances(self, region, params):
+        total = self.per_region // 5
+        page = self.page(total, params)
+        instances = [{'DBInstanceId': 'rm-%s-%d' % (region, i)} for i in page]
+        return {'TotalRecordCount': total, 'Items': {'DBInstance': instances}}, len(instances)
+
+    def action_DescribeDBInstanceAttribute(self, region, params):
+        ins_id = params['DBInstanceId']
+        return {'Items': {'DBInstanceAttribute': [{
+            'DBInstanceId': ins_id,
+            'RegionId': ins_id.split('-', 1)[1].rsplit('-', 1)[0],
+            'DBInstanceStatus': 'Running',
+            'ConnectionString': ins_id + '.mysql.rds.aliyuncs.com',
+            'ReadOnlyDBInstanceIds': {'ReadOnlyDBInstanceId': []},
+            'ExpireTime': '2020-06-01T16:00:00Z',
+            'DBInstanceCPU': '2',
+            'DBInstanceMemory': 4096,
+            'DBInstanceStorage': 100,
+            'DBInstanceClass': 'rds.mysql.s2.large',
+            'DBInstanceClassType': 'x4',
+            'MaxConnections': 1200,
+            'MaxIOPS': 2000,
+            'DBMaxQuantity': 200,
+            'AccountMaxQuantity': 200,
+        }]}}, 1
+
+    def action_QueryDomainList(self, region, params):
+        size = int(params['PageSize'])
+        page = self.page(self.domains, params, 'PageNum')
+        domains = [{
+            'DomainName': 'example-%d.com' % i,
+            'InstanceId': 'S%d' % i,
+            'DomainStatus': '1',
+            'RegistrantType': '2',
+            'RegistrationDate': '2015-01-01 00:00:00',
+            'ExpirationDate': '2021-%02d-01 00:00:00' % (i % 12 + 1),
+        } for i in page]
+        return {'TotalPageNum': (self.domains + size - 1) // size, 'Data': {'Domain': domains}}, len(domains)
+
+    def action_QueryDomainByInstanceId(self, region, params):
+        return {
+            'InstanceId': params['InstanceId'],
+            'DnsList': {'Dns': ['dns1.hichina.com', 'dns2.hichina.com']},
+            'ZhRegistrantOrganization': 'mock',
+            'Email': 'mock@example.com',
+            'DomainNameVerificationStatus': 'SUCCEED',
+        }, 1
+
+    def action_DescribeDomainRecords(self, region, params):
+        page = self.page(self.records, params)
+        records = [{'RecordId': str(i), 'RR': 'host-%d' % i, 'Type': 'A', 'Value': '10.0.0.1'} for i in page]
+        return {'TotalCount': self.records, 'DomainRecords': {'Record': records}}, len(records)
+
+
+def collect(resource, settings):
+    '''
+    使用指定配置采集一种资源
+    :return: 记录数
+    '''
+    if resource in REGIONAL:
+        regions = REGION(settings=settings).get_region()
+        collector = RDS(settings=settings) if resource == 'rds' else ECS(settings=settings)
+        collector.regionList = regions
+        if resource == 'ecs':
+            return len(collector.get_ecs())
+        if resource == 'disk':
+            return len(collector.get_disk())
+        return len(collector.get_rds())
+    if resource == 'domain':
+        return len(Domain(settings=settings).get_domainListInfo())
+    return len(Record(settings=settings).get_records('example.com'))
+
+
+def run(resources, workers, regions, args):
+    '''
+    按组合压测
+    :return: 结果列表
+    '''
+    results = []
+    for resource in resources:
+        region_counts = regions if resource in REGIONAL else regions[:1]
+        for region_count, page_size, max_workers in product(region_counts, PAGE_SIZES[resource], workers):
+            api = MockApi(region_count, args.per_region, args.domains, args.records, args.latency, args.item_latency,
+                          args.jitter)
+            settings = Settings(max_workers=max_workers, page_size={resource: page_size}, client_factory=api)
+            start = time.perf_counter()
+            count = collect(resource, settings)
+            seconds = time.perf_counter() - start
+            result = {
+                'resource': resource,
+                'regions': region_count,
+                'page_size': page_size,
+                'max_workers': max_workers,
+                'records': count,
+                'seconds': round(seconds, 3),
+                'throughput': round(count / seconds, 1),
+            }
+            results.append(result)
+            print('%(resource)-7s regions=%(regions)-3d page_size=%(page_size)-4d max_workers=%(max_workers)-4d '
+                  'records=%(records)-6d %(seconds)8.3fs %(throughput)10.1f/s' % result)
+            sys.stdout.flush()
+    return results
+
+
+def best_settings(results):
+    '''
+    每种资源在最大区域数下吞吐量最高的配置
+    :return: {资源: 结果}
+    '''
+    best = {}
+    for resource in PAGE_SIZES:
+        rows = [r for r in results if r['resource'] == resource]
+        if not rows:
+            continue
+        regions = max(r['regions'] for r in rows)
+        best[resource] = max((r for r in rows if r['regions'] == regions), key=lambda r: r['throughput'])
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='采集并发参数压测')
+    parser.add_argument('--resources', default=','.join(PAGE_SIZES), help='压测的资源，逗号分隔')
+    parser.add_argument('--workers', default='1,4,16,64', help='并发数，逗号分隔')
+    parser.add_argument('--regions', default='1,4,16', help='区域数，逗号分隔')
+    parser.add_argument('--per-region', type=int, default=500, help='每个区域的ECS、硬盘数')
+    parser.add_argument('--domains', type=int, default=200, help='域名数')
+    parser.add_argument('--records', type=int, default=1000, help='解析记录数')
+    parser.add_argument('--latency', type=float, default=0.02, help='每次请求的延迟（秒）')
+    parser.add_argument('--item-latency', type=float, default=0.0002, help='每条数据增加的延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='每次请求随机增加的最大延迟（秒）')
+    parser.add_argument('--json', help='结果输出到JSON文件')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    resources = [r for r in args.resources.split(',') if r]
+    workers = [int(w) for w in args.workers.split(',')]
+    regions = [int(r) for r in args.regions.split(',')]
+    results = run(resources, workers, regions, args)
+
+    best = best_settings(results)
+    print('\n最优配置:')
+    for resource, result in best.items():
+        print('%-7s page_size=%-4d max_workers=%-4d %10.1f/s (regions=%d)' % (
+            resource, result['page_size'], result['max_workers'], result['throughput'], result['regions']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results, 'best': best}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
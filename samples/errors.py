@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : errors
+# @Software       : PyCharm
+
+'''
+采集异常
+'''
+
+
+class CollectError(Exception):
+    '''
+    部分请求失败，采集结果不完整
+
+    :param failures: 失败的请求，[(区域ID, 页码或实例ID)]
+    '''
+
+    def __init__(self, failures):
+        super().__init__(failures)
+        self.failures = list(failures)
+
+    def __str__(self):
+        return '%d requests failed: %s' % (
+            len(self.failures), ', '.join('%s/%s' % failure for failure in self.failures))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : field_mapping
+# @Software       : PyCharm
+
+'''
+声明式字段映射，供ECS、RDS、Domain的字段翻译共用
+
+每种资源定义一份Mapping，创建时即生成专用的取值函数，翻译时不再解析路径，也没有逐字段的循环；
+单个字段缺失只记录缺失并使用默认值，不影响同一条记录中其他字段的翻译
+'''
+
+import hashlib
+import logging
+
+logger = logging
+
+# 取值或类型转换时视为字段缺失的异常
+MISSING_ERRORS = (KeyError, IndexError, TypeError, ValueError, AttributeError)
+
+# 生成的取值代码中表示字段缺失
+MISSING = object()
+
+
+class Field:
+    '''
+    单个字段的映射规则
+
+    :param target: 目标字段名，用"."表示嵌套，如 specs.name
+    :param path: 源字段路径，用"."分隔，数字表示列表下标，如 NetworkInterfaces.NetworkInterface.0.MacAddress
+    :param default: 源字段缺失或转换失败时使用的默认值
+    :param coerce: 类型转换函数，如 int
+    :param required: 为True时，源字段缺失计入缺失字段
+    :param omit_empty: 为True时，源字段缺失或为空则不输出此字段
+    :param value: 常量值，设置后忽略path
+    '''
+
+    def __init__(self, target, path=None, default=None, coerce=None, required=False, omit_empty=False, value=None):
+        self.target = target
+        self.path = path
+        self.default = default
+        self.coerce = coerce
+        self.required = required
+        self.omit_empty = omit_empty
+        self.value = value
+
+
+def describe(value):
+    '''
+    生成函数或常量的稳定描述，函数取其字节码及常量，修改函数体后描述随之变化
+    :param value: 函数或常量
+    :return:
+    '''
+    code = getattr(value, '__code__', None)
+    if code is None:
+        return repr(value)
+    consts = [const for const in code.co_consts if not hasattr(const, 'co_code')]
+    return '%s.%s:%s:%r' % (value.__module__, value.__qualname__, code.co_code.hex(), consts)
+
+
+def compile_path(path):
+    '''
+    将源字段路径编译为逐级检查的取值代码，逐级判断类型及键是否存在，不依赖异常
+    :param path: 源字段路径
+    :return: 代码行列表，执行后 value 为取到的值，字段不存在时为 MISSING
+    '''
+    keys = [int(key) if key.isdigit() else key for key in path.split('.')]
+    if isinstance(keys[0], int):
+        lines = ['value = MISSING']
+    else:
+        lines = ['value = get(%r, MISSING)' % keys[0]]
+    for key in keys[1:]:
+        if isinstance(key, int):
+            lines.append('value = value[%d] if isinstance(value, (list, str)) and len(value) > %d else MISSING' % (key, key))
+        else:
+            lines.append('value = value.get(%r, MISSING) if isinstance(value, dict) else MISSING' % key)
+    return lines
+
+
+def subscript_path(path):
+    '''
+    将源字段路径编译为直接取下标的表达式，字段不存在时抛出 KeyError/IndexError/TypeError
+    :param path: 源字段路径
+    :return: 表达式，如 record['NetworkInterfaces']['NetworkInterface'][0]
+    '''
+    return 'record' + ''.join('[%d]' % int(key) if key.isdigit() else '[%r]' % key for key in path.split('.'))
+
+
+def truthy_path(path, variable, prefixes=None):
+    '''
+    将源字段路径编译为逐级判断是否为空的取值代码，供可省略的字段使用；
+    中间值为空时停止，类型不符时抛出 AttributeError/KeyError/TypeError
+    :param path: 源字段路径
+    :param variable: 保存取值结果的变量名
+    :param prefixes: 已取值的路径前缀，{路径前缀: 变量名}，从最长的前缀继续取值
+    :return: 代码行列表，执行后变量为取到的值，字段不存在时为空值
+    '''
+    keys = [int(key) if key.isdigit() else key for key in path.split('.')]
+    if isinstance(keys[0], int):
+        return ['%s = None' % variable]
+    start = 1
+    lines = ['%s = get(%r)' % (variable, keys[0])]
+    for depth in range(len(keys) - 1, 0, -1):
+        prefix = '.'.join(path.split('.')[:depth])
+        if prefixes and prefix in prefixes:
+            start = depth
+            lines = ['%s = %s' % (variable, prefixes[prefix])]
+            break
+    for depth, key in enumerate(keys[start:]):
+        indent = '    ' * depth
+        lines.append('%sif %s:' % (indent, variable))
+        if key == 0:
+            # 非空的列表必有第一项
+            lines.append('%s    %s = %s[0]' % (indent, variable, variable))
+        elif isinstance(key, int):
+            lines.append('%s    %s = %s[%d] if len(%s) > %d else None' % (indent, variable, variable, key, variable, key))
+        else:
+            lines.append('%s    %s = %s.get(%r)' % (indent, variable, variable, key))
+    return lines
+
+
+def compile_extractor(fields):
+    '''
+    将字段列表编译为专用的取值函数，每个字段展开为直接的取值语句，翻译时没有逐字段的循环及函数调用
+
+    生成两个函数：extract 按下标直接取值，与手写的翻译方法相同；
+    任一字段缺失或转换失败时，改由 extract_checked 逐个字段检查，记录缺失字段并使用默认值。
+    嵌套字段的父字段位于其第一个子字段的位置，所有子字段都被省略时不输出父字段
+    :param fields: Field列表
+    :return: (extract, extract_batch, 生成的源代码)，extract 参数为单条记录，返回 (翻译结果, 缺失的目标字段列表)；
+             extract_batch 参数为记录列表，返回 (翻译结果列表, {缺失的目标字段: 缺失次数})
+    '''
+    namespace = {'MISSING': MISSING, 'MISSING_ERRORS': MISSING_ERRORS}
+    checked = [
+        'if not isinstance(record, dict):',
+        '    record = {}',
+        'get = record.get',
+        'result = {}',
+        'misses = []',
+    ]
+    # extract 的输出项：[(键, 值表达式)]，可省略字段的值表达式为None，嵌套字段的父字段为其子字段的输出项列表
+    items = []
+    # 可省略字段的取值方式：{(输出项列表的id, 键): (源字段路径或代码行, 判断条件)}
+    omits = {}
+    # 嵌套字段的父字段：{父字段名: (变量名, 子字段的输出项列表)}
+    parents = {}
+    # 类型转换函数的变量名，同一函数只有一个变量名，相同的转换可以只计算一次
+    coerces = {}
+    for i, field in enumerate(fields):
+        namespace['default_%d' % i] = field.default
+        namespace['value_%d' % i] = field.value
+        if field.coerce is not None:
+            coerce = coerces.setdefault(id(field.coerce), 'coerce_%d' % i)
+            namespace[coerce] = field.coerce
+
+        # 赋值目标
+        parent, _, child = field.target.rpartition('.')
+        if not parent:
+            target, output = 'result[%r]' % child, items
+        else:
+            if parent not in parents:
+                parents[parent] = ('parent_%d' % len(parents), [])
+                checked.append('%s = result[%r] = {}' % (parents[parent][0], parent))
+                items.append((parent, parents[parent][1]))
+            variable, output = parents[parent]
+            target = '%s[%r]' % (variable, child)
+
+        # 逐个字段检查的取值语句
+        if field.path is None:
+            lines = ['value = value_%d' % i]
+        else:
+            lines = compile_path(field.path)
+        if field.coerce is not None:
+            lines.extend([
+                'if value is not MISSING:',
+                '    try:',
+                '        value = %s(value)' % coerce,
+                '    except MISSING_ERRORS:',
+                '        value = MISSING',
+            ])
+
+        if field.omit_empty:
+            checked.extend(lines)
+            checked.extend([
+                'if value is not MISSING and value:',
+                '    %s = value' % target,
+            ])
+            # 缺失与空值同样省略，extract 中逐级判断是否为空，缺失时不必改走 extract_checked；
+            # 有类型转换时空值转换后可能不为空，与 extract_checked 相同逐级检查
+            output.append((child, None))
+            if field.path is not None and field.coerce is None:
+                omits[id(output), child] = (field.path, 'value')
+            else:
+                omits[id(output), child] = (lines, 'value is not MISSING and value')
+            continue
+
+        checked.extend(lines)
+        checked.append('if value is MISSING:')
+        if field.required:
+            checked.append('    misses.append(%r)' % field.target)
+        checked.append('    value = default_%d' % i)
+        checked.append('%s = value' % target)
+
+        # 直接取值的表达式
+        if field.path is None:
+            value = 'value_%d' % i
+        elif '.' not in field.path and not field.required and field.coerce is None:
+            if field.default is None:
+                value = 'get(%r)' % field.path
+            else:
+                value = 'get(%r, default_%d)' % (field.path, i)
+        else:
+            value = subscript_path(field.path)
+        if field.coerce is not None:
+            value = '%s(%s)' % (coerce, value)
+        output.append((child, value))
+
+    # 同一表达式出现多次时只计算一次，如 specs.memory 与 memory
+    fast = ['get = record.get']
+    counts = {}
+    for key, value in items + [item for _, children in parents.values() for item in children]:
+        if isinstance(value, str) and not value.startswith('value_'):
+            counts[value] = counts.get(value, 0) + 1
+    shared = {}
+    for value, count in counts.items():
+        if count > 1:
+            shared[value] = 'shared_%d' % len(shared)
+            fast.append('%s = %s' % (shared[value], value))
+    # 可省略字段的相同路径前缀同样只取一次，如 NetworkInterfaces.NetworkInterface.0
+    counts = {}
+    for path, _ in omits.values():
+        if isinstance(path, str) and '.' in path:
+            prefix = path.rsplit('.', 1)[0]
+            counts[prefix] = counts.get(prefix, 0) + 1
+    prefixes = {}
+    for prefix, count in counts.items():
+        if count > 1:
+            prefixes[prefix] = 'prefix_%d' % len(prefixes)
+            fast.extend(truthy_path(prefix, prefixes[prefix], prefixes))
+
+    def display(output):
+        return '{%s}' % ', '.join('%r: %s' % (key, shared.get(value, value)) for key, value in output)
+
+    def unconditional(value):
+        return isinstance(value, str) or isinstance(value, list) and all(v is not None for _, v in value)
+
+    def assign(output, container, key, value):
+        if isinstance(value, str):
+            fast.append('%s[%r] = %s' % (container, key, shared.get(value, value)))
+            return
+        lines, condition = omits[id(output), key]
+        if isinstance(lines, str):
+            lines = truthy_path(lines, 'value', prefixes)
+        fast.extend(lines)
+        fast.append('if %s:' % condition)
+        fast.append('    %s[%r] = value' % (container, key))
+
+    # 开头连续的不可省略字段用一个字典字面量构造，其后逐个字段赋值，保持字段顺序
+    leading = 0
+    while leading < len(items) and unconditional(items[leading][1]):
+        leading += 1
+    fast.append('result = {%s}' % ', '.join(
+        '%r: %s' % (key, shared.get(value, value) if isinstance(value, str) else display(value))
+        for key, value in items[:leading]))
+    for key, value in items[leading:]:
+        if not isinstance(value, list):
+            assign(items, 'result', key, value)
+        elif unconditional(value):
+            fast.append('result[%r] = %s' % (key, display(value)))
+        else:
+            variable = parents[key][0]
+            fast.append('%s = result[%r] = {}' % (variable, key))
+            for child, child_value in value:
+                assign(value, variable, child, child_value)
+            fast.extend([
+                'if not %s:' % variable,
+                '    del result[%r]' % key,
+            ])
+    for parent, (variable, output) in parents.items():
+        if not unconditional(output):
+            checked.extend([
+                'if not %s:' % variable,
+                '    del result[%r]' % parent,
+            ])
+    checked.append('return result, misses')
+
+    # extract 处理单条记录；extract_batch 在循环中展开 extract 的语句，批量翻译时没有逐条记录的函数调用
+    single = ['try:'] + ['    ' + line for line in fast] + [
+        'except MISSING_ERRORS:',
+        '    return extract_checked(record)',
+        'return result, []',
+    ]
+    batch = [
+        'results = []',
+        'append = results.append',
+        'missed = {}',
+        'for record in records:',
+        '    try:',
+    ] + ['        ' + line for line in fast] + [
+        '    except MISSING_ERRORS:',
+        '        result, misses = extract_checked(record)',
+        '        for target in misses:',
+        '            missed[target] = missed.get(target, 0) + 1',
+        '    append(result)',
+        'return results, missed',
+    ]
+    source = ''.join('def %s:\n%s\n\n' % (name, '\n'.join('    ' + line for line in body)) for name, body in (
+        ('extract_checked(record)', checked), ('extract(record)', single), ('extract_batch(records)', batch)))
+    exec(compile(source, '<mapping>', 'exec'), namespace)
+    return namespace['extract'], namespace['extract_batch'], source
+
+
+class Mapping:
+    '''
+    一种资源的字段映射表，创建时编译为专用的取值函数，之后可重复用于单条或批量翻译
+
+    :param fields: Field列表，输出字段顺序与列表顺序一致
+    :param key: 记录的标识字段，仅用于缺失日志
+    '''
+
+    def __init__(self, fields, key=None):
+        self.fields = list(fields)
+        self.key = key
+        # 映射表的指纹，字段定义变化后随之变化，用于区分缓存的翻译结果
+        self.fingerprint = hashlib.sha1(repr([
+            (field.target, field.path, describe(field.default), describe(field.coerce), field.required,
+             field.omit_empty, describe(field.value))
+            for field in self.fields
+        ]).encode('utf-8')).hexdigest()[:12]
+        self._extract, self._extract_batch, self.source = compile_extractor(self.fields)
+
+    def extract(self, record):
+        '''
+        翻译单条记录
+        :param record: 接口返回的单条数据
+        :return: (翻译结果, 缺失的目标字段列表)
+        '''
+        return self._extract(record)
+
+    def translate(self, record):
+        '''
+        翻译单条记录，缺失字段记录到日志
+        :param record: 接口返回的单条数据
+        :return: 翻译结果
+        '''
+        result, misses = self.extract(record)
+        if misses:
+            logger.warning('%s missing fields: %s', self.__ident(record), ', '.join(misses))
+        return result
+
+    def translate_batch(self, records):
+        '''
+        批量翻译，缺失字段按字段汇总后记录一次日志
+        :param records: 接口返回的数据列表
+        :return: 翻译结果列表
+        '''
+        results, missed = self._extract_batch(records)
+        if missed:
+            logger.warning('missing fields in %d records: %s', len(results),
+                           ', '.join('%s(%d)' % item for item in missed.items()))
+        return results
+
+    def __ident(self, record):
+        if self.key and isinstance(record, dict):
+            return record.get(self.key)
+        return None
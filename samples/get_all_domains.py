@@ -17,7 +17,11 @@ https://help.aliyun.com/document_detail/67712.html?spm=a2c4g.11174283.6.674.bcae
 
 import json
 import logging
-from aliyunsdkcore.client import AcsClient
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from field_mapping import Field, Mapping
+from response_cache import CachedPage
+from settings import Settings
 from aliyunsdkdomain.request.v20180129.QueryDomainListRequest import QueryDomainListRequest
 from aliyunsdkdomain.request.v20180129.QueryDomainByInstanceIdRequest import QueryDomainByInstanceIdRequest
 
@@ -28,6 +32,26 @@ logging.basicConfig(
 )
 logger = logging
 
+# 域名列表字段映射
+DOMAIN_MAPPING = Mapping([
+    Field('name', 'DomainName', required=True),
+    Field('domain_isp', value=1),
+    Field('domain_id', 'InstanceId', required=True),
+    Field('domain_status', 'DomainStatus', coerce=int, required=True),
+    Field('registrant_type', 'RegistrantType', coerce=int, required=True),
+    Field('registration_date', 'RegistrationDate', required=True),
+    Field('expiration_date', 'ExpirationDate', required=True),
+], key='InstanceId')
+
+# 域名注册信息字段映射
+DOMAIN_INFO_MAPPING = Mapping([
+    Field('nameserver_master', 'DnsList.Dns.0', required=True),
+    Field('nameserver_slave', 'DnsList.Dns.1', required=True),
+    Field('owner', 'ZhRegistrantOrganization', required=True),
+    Field('email', 'Email', required=True),
+    Field('verification_status', 'DomainNameVerificationStatus', required=True),
+], key='InstanceId')
+
 
 class Domain:
     '''
@@ -38,22 +62,50 @@ class Domain:
     返回此账户下所有的域名信息
     '''
 
-    def __init__(self, access_key=None, secret=None):
-        self.page_size = 50
+    def __init__(self, access_key=None, secret=None, cache=None, settings=None):
+        self.settings = settings or Settings()
+        self.page_size = self.settings.page_size['domain']
         self.access_key = access_key
         self.secret = secret
-        self.client = AcsClient(self.access_key, self.secret, "cn-hangzhou")
+        self.client = self.settings.client_factory(self.access_key, self.secret, "cn-hangzhou")
+        self.cache = cache
+        self.MaxWorkers = self.settings.max_workers
+        self.local = threading.local()
         self.TotalPageNum = 0
         self.TotalItemNum = 0
-        self.currentPage = []
+        self.currentPage = None
+
+    def __thread_client(self):
+        '''
+        当前线程的连接，每个线程只创建一次，避免每次请求都创建 AcsClient
+        :return:
+        '''
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.settings.client_factory(self.access_key, self.secret, "cn-hangzhou")
+        return client
+
+    def __do_action(self, request, client=None):
+        page = self.__do_page(request, client)
+        if page:
+            return page.data
 
-    def __do_action(self, request):
+    def __do_page(self, request, client=None):
+        '''
+        发送请求，启用缓存时经由缓存获取
+        :param request: 请求
+        :param client: 连接，默认为当前连接
+        :return: CachedPage
+        '''
+        client = client or self.client
         try:
-            response = self.client.do_action_with_exception(request)
+            if self.cache:
+                return self.cache.fetch(request, client)
+            response = client.do_action_with_exception(request)
         except Exception as e:
             logger.error(e)
             return
-        return json.loads(str(response, encoding='utf-8'))
+        return CachedPage(json.loads(str(response, encoding='utf-8')))
 
     def __get_total_page_num(self, PageNum=1):
         '''
@@ -65,50 +117,51 @@ class Domain:
         request.set_accept_format('json')
         request.set_PageNum(PageNum)
         request.set_PageSize(int(self.page_size))
-        response = self.__do_action(request)
-        if response:
-            self.currentPage = response['Data']['Domain']
+        page = self.__do_page(request)
+        if page:
+            self.currentPage = page
             if PageNum == 1:
-                self.TotalPageNum = int(response['TotalPageNum'])
+                self.TotalPageNum = int(page.data['TotalPageNum'])
 
     def __get_domainInfo(self, domainIns):
         '''
-        获取域名详细注册信息，同whois查询结果
+        获取域名详细注册信息，同whois查询结果，并发调用，每个线程使用独立的连接
         :return:
         '''
         request = QueryDomainByInstanceIdRequest()
         request.set_InstanceId(domainIns)
-        return self.__do_action(request)
+        return self.__do_page(request, self.__thread_client())
 
     def __translate(self, domain):
         '''
         字段翻译，只获取需要的部分，便于入库
-        :param domain:
+        :param domain: 已翻译的域名列表字段
         :return:
         '''
-        domainInfo = {}
-        domainInfo['name'] = domain['DomainName']
-        domainInfo['domain_isp'] = 1
-        domainInfo['domain_id'] = domain['InstanceId']
-        domainInfo['domain_status'] = int(domain['DomainStatus'])
-        domainInfo['registrant_type'] = int(domain['RegistrantType'])
-        domainInfo['registration_date'] = domain['RegistrationDate']
-        domainInfo['expiration_date'] = domain['ExpirationDate']
-        info = self.__get_domainInfo(domain['InstanceId'])
-        domainInfo['nameserver_master'] = info['DnsList']['Dns'][0]
-        domainInfo['nameserver_slave'] = info['DnsList']['Dns'][1]
-        domainInfo['owner'] = info['ZhRegistrantOrganization']
-        domainInfo['email'] = info['Email']
-        domainInfo['verification_status'] = info['DomainNameVerificationStatus']
+        domainInfo = dict(domain)
+        info = self.__get_domainInfo(domainInfo['domain_id'])
+        if info:
+            name = 'domain_info:' + DOMAIN_INFO_MAPPING.fingerprint
+            domainInfo.update(info.translate(name, DOMAIN_INFO_MAPPING.translate))
+        else:
+            domainInfo.update(DOMAIN_INFO_MAPPING.translate({}))
         return domainInfo
 
+    def __translate_page(self, data):
+        return DOMAIN_MAPPING.translate_batch(data['Data']['Domain'])
+
     def get_domainListInfo(self):
         domainListInfo = []
         if not self.client: return []
         self.__get_total_page_num()
-        for page in range(1, self.TotalPageNum + 1):
-            self.__get_total_page_num(page)
-            domainListInfo.extend(list(map(self.__translate, self.currentPage)))
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor:
+            for page in range(1, self.TotalPageNum + 1):
+                if page > 1:
+                    self.__get_total_page_num(page)
+                # 内容未变化的页直接复用上次的翻译结果
+                name = 'domain:' + DOMAIN_MAPPING.fingerprint
+                domains = self.currentPage.translate(name, self.__translate_page) if self.currentPage else []
+                domainListInfo.extend(executor.map(self.__translate, domains))
         return domainListInfo
 
 
@@ -20,8 +20,12 @@ https://help.aliyun.com/document_detail/25514.html?spm=a2c4g.11186623.6.1216.39a
 
 import json
 import logging
-from multiprocessing import Pool
-from aliyunsdkcore.client import AcsClient
+from concurrent.futures import ThreadPoolExecutor
+from field_mapping import Field, Mapping
+from response_cache import CachedPage
+from sharding import JsonLinesSink, run_shards, split_pages
+from settings import Settings
+from errors import CollectError
 from aliyunsdkecs.request.v20140526.DescribeInstancesRequest import DescribeInstancesRequest
 from aliyunsdkecs.request.v20140526.DescribeRegionsRequest import DescribeRegionsRequest
 from aliyunsdkecs.request.v20140526.DescribeDisksRequest import DescribeDisksRequest
@@ -39,6 +43,43 @@ def print_dict_key(item, key):
     return region_id
 
 
+def power_state(status):
+    if status != 'Running':
+        return 'poweredOff'
+    return 'poweredOn'
+
+
+# ECS实例字段映射
+ECS_MAPPING = Mapping([
+    Field('disk', value=0),
+    Field('hostname', 'HostName', required=True),
+    Field('host_ip', 'NetworkInterfaces.NetworkInterface.0.PrimaryIpAddress', omit_empty=True),
+    Field('public_ip', 'PublicIpAddress.IpAddress.0', omit_empty=True),
+    Field('mac', 'NetworkInterfaces.NetworkInterface.0.MacAddress', omit_empty=True),
+    Field('os', 'OSNameEn', required=True),
+    Field('cpu', 'Cpu', required=True),
+    Field('memory', 'Memory', coerce=lambda memory: int(memory / 1024), required=True),
+    Field('sn', 'SerialNumber', required=True),
+    Field('instance_id', 'InstanceId', required=True),
+    Field('instance_name', 'InstanceName', required=True),
+    Field('create_time', 'CreationTime', required=True),
+    Field('expiration_time', 'ExpiredTime', required=True),
+    Field('zone', 'ZoneId', required=True),
+    Field('region', 'RegionId', required=True),
+    Field('status', 'Status', required=True),
+    Field('power_state', 'Status', coerce=power_state, required=True),
+    Field('ostype', 'OSType', required=True),
+    Field('instancechargetype', 'InstanceChargeType', required=True),
+    Field('internetchargetype', 'InternetChargeType', required=True),
+    Field('salecycle', 'SaleCycle', default=''),
+    Field('comment', 'Description', default=''),
+    Field('specs.name', 'InstanceType', required=True),
+    Field('specs.family', 'InstanceTypeFamily', required=True),
+    Field('specs.cpu', 'Cpu', required=True),
+    Field('specs.memory', 'Memory', required=True),
+], key='InstanceId')
+
+
 class ECS:
     '''
     获取阿里云当前账户下所有的ECS主机及其详细信息
@@ -46,94 +87,149 @@ class ECS:
     参考文档：https://help.aliyun.com/document_detail/25514.html?spm=a2c4g.11186623.6.1216.39a5431dHF33HN
     '''
 
-    def __init__(self, access_key_id=None, access_key_secret=None):
+    def __init__(self, access_key_id=None, access_key_secret=None, cache=None, settings=None):
         self.access_key = access_key_id
         self.secret = access_key_secret
         self.client = None
-        self.currentPage = []
+        self.cache = cache
+        self.settings = settings or Settings()
         self.regionList = []
-        self.instance_list_total = []
-        self.disk_list_total = []
-        self.TotalPageNum = 0
-        self.PageSize = 100
+        self.PageSize = self.settings.page_size['ecs']
+        self.DiskPageSize = self.settings.page_size['disk']
+        self.MaxWorkers = self.settings.max_workers
+        self.PagesPerShard = self.settings.pages_per_shard['ecs']
+
+    def __getstate__(self):
+        # 分片执行时传给子进程，不传连接；子进程按分片参数采集，不需要区域及实例列表
+        state = self.__dict__.copy()
+        state['client'] = None
+        state['regionList'] = []
+        return state
+
+    def __new_client(self, region_id='cn-hangzhou'):
+        return self.settings.client_factory(self.access_key, self.secret, region_id)
 
     def __get_client(self, region_id='cn-hangzhou'):
-        self.client = AcsClient(self.access_key, self.secret, region_id)
+        self.client = self.__new_client(region_id)
+
+    def __do_action(self, request, client=None):
+        page = self.__do_page(request, client)
+        if page:
+            return page.data
 
-    def __do_action(self, request):
+    def __do_page(self, request, client=None):
+        '''
+        发送请求，启用缓存时经由缓存获取
+        :param request: 请求
+        :param client: 连接，默认为当前连接
+        :return: CachedPage
+        '''
+        client = client or self.client
         try:
             request.set_accept_format('json')
-            response = self.client.do_action_with_exception(request)
+            if self.cache:
+                return self.cache.fetch(request, client)
+            response = client.do_action_with_exception(request)
         except Exception as e:
             logger.error(e)
             return
-        return json.loads(str(response, encoding='utf-8'))
+        return CachedPage(json.loads(str(response, encoding='utf-8')))
+
+    def __get_total_page_num(self, total_count, page_size):
+        '''
+        根据总数计算页数
+        :param total_count: 资源总数
+        :param page_size: 页大小
+        :return:
+        '''
+        if int(total_count) % page_size != 0:
+            return int(total_count / page_size) + 1
+        return int(total_count / page_size)
 
-    def __get_total_page_num(self, PageNum=1, PageSize=1):
+    def __get_instance_page(self, client, PageNum=1, PageSize=1):
         '''
-        获取ECS总数，及当前页ECS列表
+        获取当前页ECS列表
+        :param client: 所在区域的连接
         :param PageNum: 页ID
         :param PageSize: 页大小
-        :return:
+        :return: CachedPage
         '''
         request = DescribeInstancesRequest()
         request.set_PageNumber(PageNum)
         request.set_PageSize(PageSize)
-        response = self.__do_action(request)
-        if self.TotalPageNum != 0:
-            ins_obj = response['Instances']['Instance']
-            self.instance_list_total.extend(ins_obj)
-            return
+        return self.__do_page(request, client)
 
-        else:
-            if int(response['TotalCount']) % self.PageSize != 0:
-                self.TotalPageNum = int(response['TotalCount'] / self.PageSize) + 1
-            else:
-                self.TotalPageNum = int(response['TotalCount'] / self.PageSize)
-            return self.TotalPageNum
-
-    def __get_disk_total_page_num(self, PageNum=1, PageSize=1):
+    def __get_disk_page(self, client, PageNum=1, PageSize=1):
+        '''
+        获取当前页硬盘列表
+        :param client: 所在区域的连接
+        :param PageNum: 页ID
+        :param PageSize: 页大小
+        :return: CachedPage
+        '''
         request = DescribeDisksRequest()
         request.set_PageSize(PageSize)
         request.set_PageNumber(PageNum)
-        response = self.__do_action(request)
-
-        if self.TotalPageNum != 0:
-            ins_obj = response['Disks']['Disk']
-            self.disk_list_total.extend(ins_obj)
-            return
+        return self.__do_page(request, client)
 
-        else:
-            if int(response['TotalCount']) % self.PageSize != 0:
-                self.TotalPageNum = int(response['TotalCount'] / self.PageSize) + 1
-            else:
-                self.TotalPageNum = int(response['TotalCount'] / self.PageSize)
-            return self.TotalPageNum
+    def __get_all_pages(self, get_page, region, page_size):
+        '''
+        按区获取所有分页，只返回本区的结果，不修改共享状态
+        :param get_page: 分页获取方法
+        :param region: 区域ID
+        :param page_size: 页大小
+        :return: 本区所有分页，有页获取失败时抛出 CollectError
+        '''
+        client = self.__new_client(region)
+        first = get_page(client, 1, page_size)
+        if not first:
+            raise CollectError([(region, 1)])
+        pages = [first]
+        failures = []
+        for page in range(2, self.__get_total_page_num(first.data['TotalCount'], page_size) + 1):
+            result = get_page(client, page, page_size)
+            if not result:
+                failures.append((region, page))
+            pages.append(result)
+        if failures:
+            raise CollectError(failures)
+        return pages
 
     def __get_ecs_of_region(self, region):
         '''
         按区获取
         :param region:
-        :return:
+        :return: 本区所有ECS分页
         '''
-        self.TotalPageNum = 0
-        self.__get_client(region)
-        self.__get_total_page_num()
-        # self.instance_list_obj.clear()
-        list(map(self.__get_total_page_num, range(1, self.TotalPageNum + 1), [self.PageSize] * self.TotalPageNum))
-        return
+        return self.__get_all_pages(self.__get_instance_page, region, self.PageSize)
 
     def __get_disk_of_region(self, region):
         '''
         按区获取硬盘
         :param region:
+        :return: 本区所有硬盘分页
+        '''
+        return self.__get_all_pages(self.__get_disk_page, region, self.DiskPageSize)
+
+    def __collect(self, task, regions):
+        '''
+        各区并发获取，由调用方按区域顺序统一合并结果，保证输出与串行获取一致
+        所有区域完成后，如有请求失败，抛出包含全部失败区域及页码的 CollectError，不返回不完整的结果
+        :param task: 按区获取的方法
+        :param regions: 区域ID列表
         :return:
         '''
-        self.TotalPageNum = 0
-        self.__get_client(region)
-        self.__get_disk_total_page_num()
-        list(map(self.__get_disk_total_page_num, range(1, self.TotalPageNum + 1), [self.PageSize] * self.TotalPageNum))
-        return
+        items = []
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor:
+            for future in [executor.submit(task, region) for region in regions]:
+                try:
+                    items.extend(future.result())
+                except CollectError as e:
+                    failures.extend(e.failures)
+        if failures:
+            raise CollectError(failures)
+        return items
 
     def translate(self, ins):
         '''
@@ -142,76 +238,78 @@ class ECS:
         :return:
         '''
 
-        instrance = {}
-        try:
-            instrance['disk'] = 0
-            instrance['hostname'] = ins['HostName']
-
-            if ins.get('NetworkInterfaces'):
-                instrance['host_ip'] = ins['NetworkInterfaces']['NetworkInterface'][0]['PrimaryIpAddress']
-
-            if ins['PublicIpAddress'].get('IpAddress'):
-                ip = ins['PublicIpAddress'].get('IpAddress', '')
-                instrance['public_ip'] = ip[0]
-
-            if ins.get('NetworkInterfaces'):
-                instrance['mac'] = ins['NetworkInterfaces']['NetworkInterface'][0]['MacAddress']
-
-            instrance['os'] = ins['OSNameEn']
-            instrance['cpu'] = ins['Cpu']
-            instrance['memory'] = int(ins['Memory'] / 1024)
-            instrance['sn'] = ins['SerialNumber']
-
-            instrance['instance_id'] = ins['InstanceId']
-            instrance['instance_name'] = ins['InstanceName']
-
-            instrance['create_time'] = ins['CreationTime']
-            instrance['expiration_time'] = ins['ExpiredTime']
-            instrance['zone'] = ins['ZoneId']
-            instrance['region'] = ins['RegionId']
-            instrance['status'] = ins['Status']
-            if ins['Status'] != 'Running':
-                instrance['power_state'] = 'poweredOff'
-            else:
-                instrance['power_state'] = 'poweredOn'
-
-            instrance['ostype'] = ins['OSType']
-            instrance['instancechargetype'] = ins['InstanceChargeType']
-            instrance['internetchargetype'] = ins['InternetChargeType']
-            instrance['salecycle'] = ins.get('SaleCycle', '')
-            instrance['comment'] = ins.get('Description', '')
-
-            instrance['specs'] = {
-                'name': ins['InstanceType'],
-                'family': ins['InstanceTypeFamily'],
-                'cpu': ins['Cpu'],
-                'memory': ins['Memory']
-            }
-        except Exception as e:
-            logger.error(e)
-        return instrance
+        return ECS_MAPPING.translate(ins)
+
+    def __translate_page(self, data):
+        return ECS_MAPPING.translate_batch(data['Instances']['Instance'])
 
     def get_ecs(self):
         '''
-        获取所有ECS信息
+        获取所有ECS信息，有请求失败时抛出 CollectError
         :return:
         '''
 
-        list(map(self.__get_ecs_of_region, self.regionList))
-        pool = Pool(50)
-        ins_list_total = list(pool.map(self.translate, self.instance_list_total))
+        ins_list_total = []
+        for page in self.__collect(self.__get_ecs_of_region, self.regionList):
+            # 内容未变化的页直接复用上次的翻译结果
+            ins_list_total.extend(page.translate('ecs:' + ECS_MAPPING.fingerprint, self.__translate_page))
         return ins_list_total
 
+    def __plan_shards(self, region):
+        '''
+        按区获取ECS总数，并按页切分
+        :param region:
+        :return: [(区域ID, 页码列表)]
+        '''
+        page = self.__get_instance_page(self.__new_client(region), 1, 1)
+        if not page:
+            raise CollectError([(region, 1)])
+        total_page_num = self.__get_total_page_num(page.data['TotalCount'], self.PageSize)
+        return [(region, pages) for pages in split_pages(total_page_num, self.PagesPerShard)]
+
+    def collect_shard(self, region, pages, path):
+        '''
+        在子进程中获取一个分片的ECS，翻译后写入结果文件
+        :param region: 区域ID
+        :param pages: 页码列表
+        :param path: 结果文件路径
+        :return: (结果文件路径, 记录数, 失败的请求)
+        '''
+        client = self.__new_client(region)
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor, JsonLinesSink(path) as sink:
+            fetch = lambda PageNum: self.__get_instance_page(client, PageNum, self.PageSize)
+            for PageNum, page in zip(pages, executor.map(fetch, pages)):
+                if not page:
+                    failures.append((region, PageNum))
+                    continue
+                sink.write(page.translate('ecs:' + ECS_MAPPING.fingerprint, self.__translate_page))
+        return path, sink.count, failures
+
+    def get_ecs_sharded(self, processes=None, sink_dir=None):
+        '''
+        多进程分片获取所有ECS信息，适用于资源量很大的账户
+        :param processes: 进程数，默认使用配置中的进程数
+        :param sink_dir: 结果文件目录，默认为临时目录
+        :return: 结果文件路径列表，按区域及页顺序排列，可用 sharding.read_sinks 读取
+        '''
+        shards = self.__collect(self.__plan_shards, self.regionList)
+        return run_shards(self, shards, 'ecs', processes or self.settings.processes, sink_dir)
+
+    @staticmethod
+    def __disks_of_page(data):
+        return data['Disks']['Disk']
+
     def get_disk(self):
         '''
-        获取所有硬盘信息
+        获取所有硬盘信息，有请求失败时抛出 CollectError
         :return:
         '''
 
-        self.PageSize = 100
-        list(map(self.__get_disk_of_region, self.regionList))
-
-        return self.disk_list_total
+        disk_list_total = []
+        for page in self.__collect(self.__get_disk_of_region, self.regionList):
+            disk_list_total.extend(page.translate('disk', self.__disks_of_page))
+        return disk_list_total
 
     def get_region(self):
         '''
@@ -20,8 +20,13 @@ https://help.aliyun.com/document_detail/26231.html?spm=a2c4g.11186623.6.1449.760
 
 import json
 import logging
-from multiprocessing import Pool
-from aliyunsdkcore.client import AcsClient
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from field_mapping import Field, Mapping
+from response_cache import CachedPage
+from sharding import JsonLinesSink, run_shards, split_pages
+from settings import Settings
+from errors import CollectError
 from aliyunsdkecs.request.v20140526.DescribeRegionsRequest import DescribeRegionsRequest
 from aliyunsdkrds.request.v20140815.DescribeDBInstancesRequest import DescribeDBInstancesRequest
 from aliyunsdkrds.request.v20140815.DescribeDBInstanceAttributeRequest import DescribeDBInstanceAttributeRequest
@@ -39,6 +44,56 @@ def print_dict_key(item, key):
     return region_id
 
 
+def to_gb(memory):
+    return int(memory) / 1024
+
+
+# RDS实例字段映射
+RDS_MAPPING = Mapping([
+    Field('instance_id', 'DBInstanceId', required=True),
+    Field('instance_name', 'DBInstanceDescription'),
+    Field('instance_type', 'DBInstanceType'),
+    Field('instancenet_type', 'DBInstanceNetType'),
+    Field('vpc_cloud_instance_id', 'VpcCloudInstanceId'),
+    Field('vpc_id', 'VpcId'),
+    Field('connection_mode', 'ConnectionMode'),
+    Field('vswitch_id', 'VSwitchId'),
+    Field('host_address', 'ConnectionString'),
+    Field('port', 'Port'),
+    Field('engine', 'Engine'),
+    Field('engine_version', 'EngineVersion'),
+    Field('status', 'DBInstanceStatus'),
+    Field('lock_mode', 'LockMode'),
+    # 如果有被锁定，则取其原因
+    Field('lock_reason', 'LockReason', omit_empty=True),
+    Field('resource_group_id', 'ResourceGroupId'),
+    Field('zone', 'ZoneId'),
+    Field('region', 'RegionId'),
+    Field('category', 'Category'),
+    # 如果有设置时区，则取值
+    Field('timezone', 'TimeZone', omit_empty=True),
+    Field('instancechargetype', 'PayType'),
+    Field('comment', 'DBInstanceDescription'),
+    # 如果有只读实例，则取其ID
+    Field('readonly_ins', 'ReadOnlyDBInstanceIds.ReadOnlyDBInstanceId', omit_empty=True),
+    Field('maintain_time', 'MaintainTime'),
+    Field('create_time', 'CreationTime'),
+    Field('expiration_time', 'ExpireTime'),
+    Field('cpu', 'DBInstanceCPU'),
+    Field('memory', 'DBInstanceMemory', coerce=to_gb, required=True),
+    Field('disk', 'DBInstanceStorage', required=True),
+    # 规格
+    Field('specs.name', 'DBInstanceClass', required=True),
+    Field('specs.family', 'DBInstanceClassType', required=True),
+    Field('specs.cpu', 'DBInstanceCPU'),
+    Field('specs.memory', 'DBInstanceMemory', coerce=to_gb, required=True),
+    Field('specs.max_conn', 'MaxConnections', required=True),
+    Field('specs.max_iops', 'MaxIOPS', required=True),
+    Field('specs.db_max_quantity', 'DBMaxQuantity', required=True),
+    Field('specs.account_max_quantity', 'AccountMaxQuantity', required=True),
+], key='DBInstanceId')
+
+
 class RDS:
     '''
     获取阿里云当前账户下所有的RDS实例及其详细信息
@@ -46,81 +101,163 @@ class RDS:
     参考文档：https://help.aliyun.com/document_detail/26231.html?spm=a2c4g.11186623.6.1449.760a75abInu9sW
     '''
 
-    def __init__(self, access_key_id=None, access_key_secret=None):
+    def __init__(self, access_key_id=None, access_key_secret=None, cache=None, settings=None):
         self.access_key = access_key_id
         self.secret = access_key_secret
         self.client = None
-        self.currentPage = []
+        self.cache = cache
+        self.settings = settings or Settings()
         self.regionList = []
-        self.instance_list_total = []
         self.instance_ids_list = []
-        self.TotalPageNum = 0
-        self.PageSize = 100
+        self.PageSize = self.settings.page_size['rds']
+        self.MaxWorkers = self.settings.max_workers
+        self.PagesPerShard = self.settings.pages_per_shard['rds']
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # 分片执行时传给子进程，不传连接；子进程按分片参数采集，不需要区域及实例列表
+        state = self.__dict__.copy()
+        state['client'] = None
+        state['regionList'] = []
+        state['instance_ids_list'] = []
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def __new_client(self, region_id='cn-hangzhou'):
+        return self.settings.client_factory(self.access_key, self.secret, region_id)
+
+    def __thread_client(self):
+        '''
+        当前线程的连接，每个线程只创建一次，避免每次请求都创建 AcsClient
+        :return:
+        '''
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.__new_client()
+        return client
 
     def __get_client(self, region_id='cn-hangzhou'):
-        self.client = AcsClient(self.access_key, self.secret, region_id)
+        self.client = self.__new_client(region_id)
 
-    def __do_action(self, request):
+    def __do_action(self, request, client=None):
+        page = self.__do_page(request, client)
+        if page:
+            return page.data
+
+    def __do_page(self, request, client=None):
+        '''
+        发送请求，启用缓存时经由缓存获取
+        :param request: 请求
+        :param client: 连接，默认为当前连接
+        :return: CachedPage
+        '''
+        client = client or self.client
         try:
             request.set_accept_format('json')
-            response = self.client.do_action_with_exception(request)
+            if self.cache:
+                return self.cache.fetch(request, client)
+            response = client.do_action_with_exception(request)
         except Exception as e:
             logger.error(e)
             return
-        return json.loads(str(response, encoding='utf-8'))
+        return CachedPage(json.loads(str(response, encoding='utf-8')))
 
-    def __get_total_page_num(self, PageNum=1, PageSize=1):
+    def __get_total_page_num(self, total_count):
         '''
-        获取RDS总数，及当前页RDS列表
+        根据总数计算页数
+        :param total_count: RDS总数
+        :return:
+        '''
+        if int(total_count) % self.PageSize != 0:
+            return int(total_count / self.PageSize) + 1
+        return int(total_count / self.PageSize)
+
+    def __get_instance_page(self, client, PageNum=1, PageSize=1):
+        '''
+        获取当前页RDS列表及RDS总数
+        :param client: 所在区域的连接
         :param PageNum: 页ID
         :param PageSize: 页大小
-        :return:
+        :return: (RDS总数, 当前页RDS列表)，请求失败时为None
         '''
         request = DescribeDBInstancesRequest()
         request.set_PageNumber(PageNum)
         request.set_PageSize(PageSize)
-        response = self.__do_action(request)
-        if self.TotalPageNum != 0:
-            ins_obj = response['Items']['DBInstance']
-            self.instance_list_total.extend(ins_obj)
+        response = self.__do_action(request, client)
+        if not response:
             return
-        else:
-            if int(response['TotalRecordCount']) % self.PageSize != 0:
-                self.TotalPageNum = int(response['TotalRecordCount'] / self.PageSize) + 1
-            else:
-                self.TotalPageNum = int(response['TotalRecordCount'] / self.PageSize)
-            return self.TotalPageNum
+        return response['TotalRecordCount'], response['Items']['DBInstance']
 
     def __get_rds_of_region(self, region):
         '''
-        按区获取
+        按区获取，只返回本区的结果，不修改共享状态
         :param region:
+        :return: 本区所有RDS列表，有页获取失败时抛出 CollectError
+        '''
+        client = self.__new_client(region)
+        first = self.__get_instance_page(client, 1, self.PageSize)
+        if not first:
+            raise CollectError([(region, 1)])
+        total_count, items = first
+        items = list(items)
+        failures = []
+        for page in range(2, self.__get_total_page_num(total_count) + 1):
+            result = self.__get_instance_page(client, page, self.PageSize)
+            if not result:
+                failures.append((region, page))
+                continue
+            items.extend(result[1])
+        if failures:
+            raise CollectError(failures)
+        return items
+
+    def __collect(self, task, args):
+        '''
+        并发执行任务，由调用方按参数顺序统一合并结果，保证输出与串行获取一致
+        所有任务完成后，如有请求失败，抛出包含全部失败请求的 CollectError，不返回不完整的结果
+        :param task: 单个任务的方法，返回列表
+        :param args: 任务参数列表
         :return:
         '''
-        self.TotalPageNum = 0
-        self.__get_client(region)
-        self.__get_total_page_num()
-        # self.instance_list_obj.clear()
-        list(map(self.__get_total_page_num, range(1, self.TotalPageNum + 1), [self.PageSize] * self.TotalPageNum))
-        return
+        items = []
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor:
+            for future in [executor.submit(task, arg) for arg in args]:
+                try:
+                    items.extend(future.result())
+                except CollectError as e:
+                    failures.extend(e.failures)
+        if failures:
+            raise CollectError(failures)
+        return items
 
     def __get_rds_ids(self):
         '''
-        获取所有ECS信息
+        获取所有RDS实例ID
         :return:
         '''
 
-        list(map(self.__get_rds_of_region, self.regionList))
+        instance_list = self.__collect(self.__get_rds_of_region, self.regionList)
         self.instance_ids_list = list(
-            map(print_dict_key, self.instance_list_total, ['DBInstanceId'] * len(self.instance_list_total)))
-        self.instance_list_total = []
+            map(print_dict_key, instance_list, ['DBInstanceId'] * len(instance_list)))
         return self.instance_ids_list
 
     def __get_rds_attribute(self, ins_id):
+        '''
+        获取RDS详细配置信息并翻译，内容未变化时直接复用上次的翻译结果
+        :param ins_id: RDS实例ID
+        :return:
+        '''
         request = DescribeDBInstanceAttributeRequest()
         request.set_DBInstanceId(ins_id)
-        response = self.__do_action(request)
-        self.instance_list_total.extend(response['Items']['DBInstanceAttribute'])
+        page = self.__do_page(request, self.__thread_client())
+        if not page:
+            raise CollectError([(None, ins_id)])
+        return page.translate('rds:' + RDS_MAPPING.fingerprint, self.__translate_page)
 
     def translate(self, ins):
         '''
@@ -129,88 +266,72 @@ class RDS:
         :return: 与表字段匹配的Mapping
         '''
 
-        instrance = {}
-        try:
-            instrance['instance_id'] = ins['DBInstanceId']
-            instrance['instance_name'] = ins.get('DBInstanceDescription')
-            instrance['instance_type'] = ins.get('DBInstanceType')
-            instrance['instancenet_type'] = ins.get('DBInstanceNetType')
-            instrance['vpc_cloud_instance_id'] = ins.get('VpcCloudInstanceId')
-            instrance['vpc_id'] = ins.get('VpcId')
-            instrance['connection_mode'] = ins.get('ConnectionMode')
-            instrance['vswitch_id'] = ins.get('VSwitchId')
-            instrance['host_address'] = ins.get('ConnectionString')
-            instrance['port'] = ins.get('Port')
-            instrance['engine'] = ins.get('Engine')
-            instrance['engine_version'] = ins.get('EngineVersion')
-            instrance['status'] = ins.get('DBInstanceStatus')
-            instrance['lock_mode'] = ins.get('LockMode')
-
-            # 如果有被锁定，则取其原因
-            if ins.get('LockReason'):
-                instrance['lock_reason'] = ins.get('LockReason')
-
-            instrance['resource_group_id'] = ins.get('ResourceGroupId')
-            instrance['zone'] = ins.get('ZoneId')
-            instrance['region'] = ins.get('RegionId')
-
-            instrance['category'] = ins.get('Category')
-
-            # 如果有设置时区，则取值
-            if ins.get('TimeZone'):
-                instrance['timezone'] = ins.get('TimeZone')
-
-            instrance['instancechargetype'] = ins.get('PayType')
-            instrance['comment'] = ins.get('DBInstanceDescription')
-
-            # 如果有只读实例，则取其ID
-            if ins['ReadOnlyDBInstanceIds'].get('ReadOnlyDBInstanceId'):
-                instrance['readonly_ins'] = ins['ReadOnlyDBInstanceIds'].get('ReadOnlyDBInstanceId')
-
-            instrance['maintain_time'] = ins.get('MaintainTime')
-            instrance['create_time'] = ins.get('CreationTime')
-            instrance['expiration_time'] = ins.get('ExpireTime')
-
-            instrance['cpu'] = ins.get('DBInstanceCPU')
-
-            instrance['memory'] = int(ins.get('DBInstanceMemory')) / 1024
-
-            instrance['disk'] = ins['DBInstanceStorage']
-
-            # 规格
-            instrance['specs'] = {
-                'name': ins['DBInstanceClass'],
-                'family': ins['DBInstanceClassType'],
-                'cpu': instrance['cpu'],
-                'memory': instrance['memory'],
-                'max_conn': ins['MaxConnections'],
-                'max_iops': ins['MaxIOPS'],
-                'db_max_quantity': ins['DBMaxQuantity'],
-                'account_max_quantity': ins['AccountMaxQuantity']
-            }
+        return RDS_MAPPING.translate(ins)
 
-        except Exception as e:
-            logger.error(e)
-        return instrance
+    def __translate_page(self, data):
+        return RDS_MAPPING.translate_batch(data['Items']['DBInstanceAttribute'])
 
     def get_rds(self):
         '''
-        获取所有RDS信息
+        获取所有RDS信息，有请求失败时抛出 CollectError
         :return:
         '''
 
         # 获取所有区域下的RDS实例ID
         self.__get_rds_ids()
 
-        # 初始化连接
-        self.__get_client()
-        # 获取所有RDS详细配置信息
-        list(map(self.__get_rds_attribute, self.instance_ids_list))
-        # 字段翻译
-        pool = Pool(50)
-        instance_list_total = list(pool.map(self.translate, self.instance_list_total))
+        # 获取所有RDS详细配置信息并翻译
+        instance_list_total = self.__collect(self.__get_rds_attribute, self.instance_ids_list)
         return instance_list_total
 
+    def __plan_shards(self, region):
+        '''
+        按区获取RDS总数，并按页切分
+        :param region:
+        :return: [(区域ID, 页码列表)]
+        '''
+        first = self.__get_instance_page(self.__new_client(region), 1, 1)
+        if not first:
+            raise CollectError([(region, 1)])
+        total_page_num = self.__get_total_page_num(first[0])
+        return [(region, pages) for pages in split_pages(total_page_num, self.PagesPerShard)]
+
+    def collect_shard(self, region, pages, path):
+        '''
+        在子进程中获取一个分片的RDS详细配置信息，翻译后写入结果文件
+        :param region: 区域ID
+        :param pages: 页码列表
+        :param path: 结果文件路径
+        :return: (结果文件路径, 记录数, 失败的请求)
+        '''
+        client = self.__new_client(region)
+        ins_ids = []
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor, JsonLinesSink(path) as sink:
+            fetch = lambda PageNum: self.__get_instance_page(client, PageNum, self.PageSize)
+            for PageNum, result in zip(pages, executor.map(fetch, pages)):
+                if not result:
+                    failures.append((region, PageNum))
+                    continue
+                items = result[1]
+                ins_ids.extend(map(print_dict_key, items, ['DBInstanceId'] * len(items)))
+            for future in [executor.submit(self.__get_rds_attribute, ins_id) for ins_id in ins_ids]:
+                try:
+                    sink.write(future.result())
+                except CollectError as e:
+                    failures.extend(e.failures)
+        return path, sink.count, failures
+
+    def get_rds_sharded(self, processes=None, sink_dir=None):
+        '''
+        多进程分片获取所有RDS信息，适用于资源量很大的账户
+        :param processes: 进程数，默认使用配置中的进程数
+        :param sink_dir: 结果文件目录，默认为临时目录
+        :return: 结果文件路径列表，按区域及页顺序排列，可用 sharding.read_sinks 读取
+        '''
+        shards = self.__collect(self.__plan_shards, self.regionList)
+        return run_shards(self, shards, 'rds', processes or self.settings.processes, sink_dir)
+
     def get_region(self):
         '''
         获取账户支持的所有区域id
@@ -17,7 +17,10 @@ https://help.aliyun.com/document_detail/67712.html?spm=a2c4g.11174283.6.674.bcae
 
 import json
 import logging
-from aliyunsdkcore.client import AcsClient
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from settings import Settings
+from response_cache import CachedPage
 from aliyunsdkalidns.request.v20150109.DescribeDomainRecordsRequest import DescribeDomainRecordsRequest
 
 logging.basicConfig(
@@ -42,25 +45,55 @@ class Record:
     返回一个域名的所有解析记录
     '''
 
-    def __init__(self, access_key_id=None, access_key_secret=None):
+    def __init__(self, access_key_id=None, access_key_secret=None, cache=None, settings=None):
         self.access_key = access_key_id
         self.secret = access_key_secret
-        self.client = AcsClient(self.access_key, self.secret, "cn-hangzhou")
+        self.settings = settings or Settings()
+        self.client = self.__new_client()
+        self.cache = cache
         self.currentPage = []
         self.TotalPageNum = 0
-        self.PageSize = 500
+        self.PageSize = self.settings.page_size['record']
+        self.MaxWorkers = self.settings.max_workers
+        self.local = threading.local()
 
-    def __do_action(self, request):
+    def __new_client(self):
+        return self.settings.client_factory(self.access_key, self.secret, "cn-hangzhou")
+
+    def __thread_client(self):
+        '''
+        当前线程的连接，每个线程只创建一次，避免每次请求都创建 AcsClient
+        :return:
+        '''
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.__new_client()
+        return client
+
+    def __do_page(self, request, client=None):
+        '''
+        发送请求，启用缓存时经由缓存获取
+        :param request: 请求
+        :param client: 连接，默认为当前连接
+        :return: CachedPage
+        '''
+        client = client or self.client
         try:
-            response = self.client.do_action_with_exception(request)
+            if self.cache:
+                return self.cache.fetch(request, client)
+            response = client.do_action_with_exception(request)
         except Exception as e:
             logger.error(e)
             return
-        return json.loads(str(response, encoding='utf-8'))
+        return CachedPage(json.loads(str(response, encoding='utf-8')))
+
+    @staticmethod
+    def __records_of_page(data):
+        return data['DomainRecords']['Record']
 
     def __get_total_page_num(self, domainName, PageNum=1, PageSize=1):
         '''
-        获取解析记录页数
+        获取解析记录页数，及当前页解析记录，并发调用，每个线程使用独立的连接
         :param domainName: 域名
         :return:
         '''
@@ -68,11 +101,13 @@ class Record:
         request.set_DomainName(domainName)
         request.set_PageNumber(PageNum)
         request.set_PageSize(PageSize)
-        response = self.__do_action(request)
+        page = self.__do_page(request, self.__thread_client())
         if self.TotalPageNum != 0:
-            return response['DomainRecords']['Record']
+            # 缓存的页每次返回新的记录列表，调用方修改不影响缓存
+            return page.translate('record', self.__records_of_page)
 
         else:
+            response = page.data
             if int(response['TotalCount']) % self.PageSize != 0:
                 self.TotalPageNum = int(response['TotalCount'] / self.PageSize) + 1
             else:
@@ -86,11 +121,13 @@ class Record:
         :return: 本域名下所有的解析信息
         '''
         self.TotalPageNum = 0
-        self.PageSize = 100
         records_list = []
         self.__get_total_page_num(domainName)
-        for p in range(1, self.TotalPageNum + 1):
-            records_list.extend(self.__get_total_page_num(domainName, p, self.PageSize))
+        pages = range(1, self.TotalPageNum + 1)
+        with ThreadPoolExecutor(max_workers=self.MaxWorkers) as executor:
+            for records in executor.map(self.__get_total_page_num, [domainName] * len(pages), pages,
+                                        [self.PageSize] * len(pages)):
+                records_list.extend(records)
         return records_list
 
 
@@ -18,7 +18,7 @@ https://help.aliyun.com/document_detail/25609.html?spm=a2c4g.11174283.6.1341.119
 
 import json
 import logging
-from aliyunsdkcore.client import AcsClient
+from settings import Settings
 from aliyunsdkecs.request.v20140526.DescribeRegionsRequest import DescribeRegionsRequest
 
 logging.basicConfig(
@@ -40,10 +40,12 @@ class REGION:
     参考文档：https://help.aliyun.com/document_detail/25609.html?spm=a2c4g.11174283.6.1341.119052feDvILXq
     '''
 
-    def __init__(self, access_key_id=None, access_key_secret=None):
+    def __init__(self, access_key_id=None, access_key_secret=None, cache=None, settings=None):
         self.access_key = access_key_id
         self.secret = access_key_secret
         self.client = None
+        self.cache = cache
+        self.settings = settings or Settings()
         self.currentPage = []
         self.regionList = []
         self.instance_list_total = []
@@ -52,11 +54,13 @@ class REGION:
         self.PageSize = 100
 
     def __get_client(self, region_id='cn-hangzhou'):
-        self.client = AcsClient(self.access_key, self.secret, region_id)
+        self.client = self.settings.client_factory(self.access_key, self.secret, region_id)
 
     def __do_action(self, request):
         try:
             request.set_accept_format('json')
+            if self.cache:
+                return self.cache.fetch(request, self.client).data
             response = self.client.do_action_with_exception(request)
         except Exception as e:
             logger.error(e)
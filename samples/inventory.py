@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : inventory
+# @Software       : PyCharm
+
+'''
+本地资产库，保存ECS、RDS、Domain翻译后的结果
+
+到期时间、区域、状态、规格均建有索引，并按IP/MAC建立反查表，
+续费提醒及IP反查主机等查询走索引，不需要遍历全部资产；
+每次完整采集后用 replace 写入，已释放的资源及其地址随之删除
+'''
+
+import json
+import logging
+import sqlite3
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+from sharding import read_sinks
+
+logger = logging
+
+# 各类资源的ID、到期时间、地址字段
+KINDS = {
+    'ecs': {'id': 'instance_id', 'expires': 'expiration_time', 'addresses': ('host_ip', 'public_ip', 'mac')},
+    'rds': {'id': 'instance_id', 'expires': 'expiration_time', 'addresses': ('host_address',)},
+    'domain': {'id': 'domain_id', 'expires': 'expiration_date', 'addresses': ()},
+}
+
+# 不带时区的时间（如域名到期时间）为北京时间
+LOCAL_OFFSET = timedelta(hours=8)
+
+TIME_FORMATS = (
+    ('%Y-%m-%dT%H:%MZ', False),
+    ('%Y-%m-%dT%H:%M:%SZ', False),
+    ('%Y-%m-%d %H:%M:%S', True),
+    ('%Y-%m-%d', True),
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resource (
+    kind TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    region TEXT,
+    status TEXT,
+    instance_type TEXT,
+    expires TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (kind, resource_id)
+);
+CREATE INDEX IF NOT EXISTS idx_resource_expires ON resource (expires);
+CREATE INDEX IF NOT EXISTS idx_resource_region ON resource (region, status, instance_type);
+CREATE INDEX IF NOT EXISTS idx_resource_status ON resource (status);
+CREATE INDEX IF NOT EXISTS idx_resource_instance_type ON resource (instance_type);
+CREATE TABLE IF NOT EXISTS address (
+    address TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    PRIMARY KEY (address, kind, resource_id)
+);
+CREATE INDEX IF NOT EXISTS idx_address_resource ON address (kind, resource_id);
+CREATE TEMP TABLE snapshot (resource_id TEXT PRIMARY KEY);
+'''
+
+
+def normalize_time(value):
+    '''
+    将接口返回的时间统一为UTC时间字符串，便于按字符串排序比较
+    :param value: 时间字符串或datetime，datetime视为UTC
+    :return: 如 2020-06-06T16:00:00Z，无法解析时为None
+    '''
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return normalize_time_str(value)
+
+
+@lru_cache(maxsize=4096)
+def normalize_time_str(value):
+    # ECS、RDS的到期时间已是UTC，补齐秒即可，不需要解析
+    if len(value) == 17 and value[10] == 'T' and value[16] == 'Z':
+        return value[:16] + ':00Z'
+    if len(value) == 20 and value[10] == 'T' and value[19] == 'Z':
+        return value
+    for fmt, local in TIME_FORMATS:
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if local:
+            parsed -= LOCAL_OFFSET
+        return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+    logger.warning('unknown time format: %s', value)
+    return None
+
+
+class Inventory:
+    '''
+    本地资产库
+
+    :param path: sqlite数据库文件路径，默认只保存在内存中
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def add(self, kind, records):
+        '''
+        写入或更新一批翻译后的资源，不影响库中已有的其他资源
+        :param kind: 资源类型，ecs、rds 或 domain
+        :param records: 翻译后的资源列表
+        :return: 写入的记录数
+        '''
+        return self.__write(kind, records, False)
+
+    def replace(self, kind, records):
+        '''
+        用一次完整采集的结果替换一类资源，结果中没有的资源（已释放）连同其地址一并删除，写入与删除在同一事务中完成
+        :param kind: 资源类型，ecs、rds 或 domain
+        :param records: 这类资源的完整列表；采集有请求失败（CollectError）时不要调用，否则未取到的资源会被删除
+        :return: 写入的记录数
+        '''
+        return self.__write(kind, records, True)
+
+    def __write(self, kind, records, replace):
+        conf = KINDS[kind]
+        rows = []
+        addresses = []
+        for record in records:
+            resource_id = record.get(conf['id'])
+            if resource_id is None:
+                continue
+            specs = record.get('specs') or {}
+            status = record.get('status', record.get('domain_status'))
+            rows.append((kind, resource_id, record.get('region'), None if status is None else str(status),
+                         specs.get('name'), normalize_time(record.get(conf['expires'])),
+                         json.dumps(record, ensure_ascii=False)))
+            for field in conf['addresses']:
+                if record.get(field):
+                    addresses.append((record[field], kind, resource_id))
+        with self.db:
+            if replace:
+                self.db.execute('DELETE FROM snapshot')
+                self.db.executemany('INSERT OR IGNORE INTO snapshot VALUES (?)', [(row[1],) for row in rows])
+                for table in ('address', 'resource'):
+                    self.db.execute('DELETE FROM %s WHERE kind = ? AND resource_id NOT IN '
+                                    '(SELECT resource_id FROM snapshot)' % table, (kind,))
+            self.db.executemany('DELETE FROM address WHERE kind = ? AND resource_id = ?',
+                                [(kind, row[1]) for row in rows])
+            self.db.executemany('INSERT OR REPLACE INTO resource VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('INSERT OR IGNORE INTO address VALUES (?, ?, ?)', addresses)
+        return len(rows)
+
+    def load_sinks(self, kind, paths):
+        '''
+        导入多进程分片采集的结果文件，替换这类资源的全部记录
+        :param kind: 资源类型
+        :param paths: 结果文件路径列表，即 get_ecs_sharded/get_rds_sharded 的返回值，所有分片均已成功
+        :return: 写入的记录数
+        '''
+        return self.replace(kind, read_sinks(paths))
+
+    def get(self, kind, resource_id):
+        row = self.db.execute('SELECT record FROM resource WHERE kind = ? AND resource_id = ?',
+                              (kind, resource_id)).fetchone()
+        if row:
+            return json.loads(row[0])
+
+    def expiring(self, before, after=None, kind=None):
+        '''
+        查询到期时间在指定范围内的资源，按到期时间排序
+        :param before: 截止时间，datetime（UTC）或时间字符串
+        :param after: 起始时间，默认不限
+        :param kind: 资源类型，默认不限
+        :return: 资源列表
+        '''
+        sql = 'SELECT record FROM resource WHERE expires <= ?'
+        args = [normalize_time(before)]
+        if after is not None:
+            sql += ' AND expires >= ?'
+            args.append(normalize_time(after))
+        if kind is not None:
+            sql += ' AND kind = ?'
+            args.append(kind)
+        return self.__query(sql + ' ORDER BY expires', args)
+
+    def expiring_in(self, days, kind=None):
+        '''
+        查询从现在起指定天数内到期的资源
+        :param days: 天数
+        :param kind: 资源类型，默认不限
+        :return: 资源列表
+        '''
+        now = datetime.utcnow()
+        return self.expiring(now + timedelta(days=days), now, kind)
+
+    def find(self, kind=None, region=None, status=None, instance_type=None):
+        '''
+        按类型、区域、状态、规格组合查询
+        :return: 资源列表
+        '''
+        conditions = []
+        args = []
+        for column, value in (('kind', kind), ('region', region), ('status', status),
+                              ('instance_type', instance_type)):
+            if value is not None:
+                conditions.append(column + ' = ?')
+                args.append(str(value))
+        sql = 'SELECT record FROM resource'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return self.__query(sql, args)
+
+    def by_address(self, address):
+        '''
+        按IP、MAC或连接地址反查资源
+        :param address: IP、MAC或连接地址
+        :return: 资源列表
+        '''
+        return self.__query('SELECT r.record FROM address a JOIN resource r '
+                            'ON r.kind = a.kind AND r.resource_id = a.resource_id WHERE a.address = ?',
+                            [address])
+
+    def count(self, kind=None):
+        if kind is None:
+            return self.db.execute('SELECT COUNT(*) FROM resource').fetchone()[0]
+        return self.db.execute('SELECT COUNT(*) FROM resource WHERE kind = ?', (kind,)).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __query(self, sql, args):
+        return [json.loads(row[0]) for row in self.db.execute(sql, args)]
+
+
+if __name__ == '__main__':
+    from get_all_ecs import ECS
+    from get_all_rds import RDS
+    from get_all_domains import Domain
+
+    # TODO: 请填入阿里云账户的Access key ID 和Secret
+    access_key_id, access_key_secret = 'YOUR-ACCESS-KEY-ID', 'YOUR-ACCESS-KEY-SECRET'
+    inventory = Inventory('inventory.db')
+
+    ecs = ECS(access_key_id, access_key_secret)
+    ecs.get_region()
+    inventory.replace('ecs', ecs.get_ecs())
+
+    rds = RDS(access_key_id, access_key_secret)
+    rds.get_region()
+    inventory.replace('rds', rds.get_rds())
+
+    inventory.replace('domain', Domain(access_key_id, access_key_secret).get_domainListInfo())
+
+    # 30天内到期的资源
+    print(inventory.expiring_in(30))
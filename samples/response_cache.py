@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : response_cache
+# @Software       : PyCharm
+
+'''
+接口响应缓存，供各采集类的 __do_action 使用
+
+按产品、API版本、Action、区域、AccessKey 及规范化后的请求参数生成缓存键，内存中保留最近使用的页（LRU），
+指定 cache_dir 时同时写入磁盘，供下次运行使用；
+重新请求后若响应内容的哈希与上次一致，则直接复用上次解析的数据及翻译结果，不再 json.loads 和翻译；
+翻译结果以JSON文本保存，每次返回新解析的对象，调用方修改返回值不影响缓存；
+磁盘缓存以JSON格式保存，其中包含完整的资产数据，cache_dir 应只对当前用户可读写
+'''
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging
+
+# 每次请求都会变化、不影响返回内容的参数
+VOLATILE_PARAMS = ('Signature', 'SignatureNonce', 'Timestamp')
+
+
+class CachedPage:
+    '''
+    一页接口响应
+
+    :param data: 解析后的响应
+    :param digest: 原始响应内容的哈希，未启用缓存时为None
+    :param translated: 已缓存的翻译结果，{名称: 翻译结果的JSON文本}
+    '''
+
+    def __init__(self, data, digest=None, translated=None):
+        self.data = data
+        self.digest = digest
+        self.translated = translated if translated is not None else {}
+        self.fetched = time.time()
+        self.cache = None
+        self.key = None
+
+    def translate(self, name, func):
+        '''
+        翻译本页数据，内容未变化时直接返回上次的翻译结果
+        :param name: 翻译结果名称，格式为 "资源:映射表指纹"，映射表变化后名称随之变化，不会复用旧的翻译结果
+        :param func: 翻译方法，参数为解析后的响应
+        :return: 翻译结果，启用缓存时每次都是新对象，可以修改
+        '''
+        text = self.translated.get(name)
+        if text is not None:
+            return json.loads(text)
+        result = func(self.data)
+        if self.cache is None:
+            return result
+        # 丢弃同一资源按旧映射表翻译的结果
+        prefix = name.split(':', 1)[0] + ':'
+        for stale in [n for n in self.translated if n.startswith(prefix)]:
+            del self.translated[stale]
+        # 翻译结果可能引用 data 中的对象，同样从JSON文本返回新对象
+        text = self.translated[name] = json.dumps(result, ensure_ascii=False)
+        self.cache.save(self)
+        return json.loads(text)
+
+
+class ResponseCache:
+    '''
+    接口响应缓存
+
+    :param maxsize: 内存中最多保留的页数
+    :param cache_dir: 磁盘缓存目录，为None时只使用内存缓存
+    :param ttl: 缓存有效期（秒），超过有效期未再请求到的页会被丢弃
+    :param max_age: 在此时间（秒）内的页直接使用缓存，不再请求接口；为0时每次都请求并比较内容哈希
+    '''
+
+    def __init__(self, maxsize=256, cache_dir=None, ttl=7 * 24 * 3600, max_age=0):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_age = max_age
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+
+    def __getstate__(self):
+        # 传给子进程时只传配置，子进程使用各自的内存缓存，磁盘缓存共享
+        return {'maxsize': self.maxsize, 'cache_dir': self.cache_dir, 'ttl': self.ttl, 'max_age': self.max_age}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def make_key(action, region, params, access_key=None, product=None, version=None):
+        '''
+        生成缓存键
+        :param action: 接口名称
+        :param region: 区域ID
+        :param params: 请求参数
+        :param access_key: 区分不同账户
+        :param product: 产品，如 Ecs、Rds，区分不同产品的同名接口
+        :param version: API版本
+        :return:
+        '''
+        params = dict((str(k), str(v)) for k, v in params.items() if k not in VOLATILE_PARAMS)
+        raw = json.dumps([product, version, action, region, access_key, params], sort_keys=True)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def fetch(self, request, client):
+        '''
+        发送请求，内容未变化时复用缓存的页
+        :param request: 请求
+        :param client: 连接
+        :return: CachedPage
+        '''
+        key = self.make_key(request.get_action_name(), client.get_region_id(), request.get_query_params(),
+                            client.get_access_key(), request.get_product(), request.get_version())
+        page = self.get(key)
+        if page is not None and time.time() - page.fetched < self.max_age:
+            return page
+
+        response = client.do_action_with_exception(request)
+        digest = hashlib.sha1(response).hexdigest()
+        if page is None or page.digest != digest:
+            page = CachedPage(json.loads(str(response, encoding='utf-8')), digest)
+        page.fetched = time.time()
+        page.cache = self
+        page.key = key
+        self.save(page)
+        return page
+
+    def get(self, key):
+        '''
+        依次从内存、磁盘中获取未过期的页
+        :param key: 缓存键
+        :return: CachedPage，不存在或已过期时为None
+        '''
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+        if page is None:
+            page = self.__load(key)
+        if page is None or time.time() - page.fetched > self.ttl:
+            return None
+        return page
+
+    def save(self, page):
+        '''
+        写入内存及磁盘缓存
+        :param page: CachedPage
+        :return:
+        '''
+        with self.lock:
+            self.pages[page.key] = page
+            self.pages.move_to_end(page.key)
+            while len(self.pages) > self.maxsize:
+                self.pages.popitem(last=False)
+        if not self.cache_dir:
+            return
+        path = self.__path(page.key)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'digest': page.digest,
+                    'fetched': page.fetched,
+                    'data': page.data,
+                    'translated': page.translated,
+                }, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(e)
+
+    def __load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.__path(key), encoding='utf-8') as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(e)
+            return None
+        # 只保留JSON文本格式的翻译结果
+        translated = dict((name, text) for name, text in item['translated'].items() if isinstance(text, str))
+        page = CachedPage(item['data'], item['digest'], translated)
+        page.fetched = item['fetched']
+        page.cache = self
+        page.key = key
+        with self.lock:
+            self.pages[key] = page
+            while len(self.pages) > self.maxsize:
+                self.pages.popitem(last=False)
+        return page
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : settings
+# @Software       : PyCharm
+
+'''
+采集配置，REGION、ECS、RDS、Domain、Record 五个采集类共用
+
+并发数、各接口的页大小、分片大小集中在此处调整，可用 benchmark_concurrency.py 压测后选取
+'''
+
+from aliyunsdkcore.client import AcsClient
+
+# 各接口默认页大小
+PAGE_SIZE = {
+    'ecs': 100,
+    'disk': 100,
+    'rds': 100,
+    'domain': 50,
+    'record': 100,
+}
+
+# 分片模式下每个分片的页数
+PAGES_PER_SHARD = {
+    'ecs': 20,
+    'rds': 5,
+}
+
+
+class Settings:
+    '''
+    采集配置
+
+    :param max_workers: 每个采集对象的并发请求数
+    :param processes: 分片模式的进程数，默认为CPU核数
+    :param page_size: {资源: 页大小}，未指定的资源使用 PAGE_SIZE 中的默认值
+    :param pages_per_shard: {资源: 每个分片的页数}，未指定的资源使用 PAGES_PER_SHARD 中的默认值
+    :param client_factory: 创建连接的方法，参数为 (access_key, secret, region_id)，默认为 AcsClient，压测时替换为模拟接口
+    '''
+
+    def __init__(self, max_workers=10, processes=None, page_size=None, pages_per_shard=None,
+                 client_factory=AcsClient):
+        self.max_workers = max_workers
+        self.processes = processes
+        self.page_size = dict(PAGE_SIZE, **(page_size or {}))
+        self.pages_per_shard = dict(PAGES_PER_SHARD, **(pages_per_shard or {}))
+        self.client_factory = client_factory
+
+    def __repr__(self):
+        return 'Settings(max_workers=%r, processes=%r, page_size=%r, pages_per_shard=%r)' % (
+            self.max_workers, self.processes, self.page_size, self.pages_per_shard)
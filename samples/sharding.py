@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : sharding
+# @Software       : PyCharm
+
+'''
+多进程分片执行，供ECS、RDS等资源量较大的账户使用
+
+按区域及页范围把采集任务切成分片，每个进程独立完成所负责分片的获取、解析、翻译及写入，
+采集对象（不含连接）在创建进程时传入一次，之后进程间只传递分片参数和结果文件路径，结果以JSON Lines格式写入文件
+'''
+
+import os
+import json
+import logging
+import tempfile
+from multiprocessing import Pool, cpu_count
+
+from errors import CollectError
+
+logger = logging
+
+# 子进程中的采集对象，由 init_worker 设置
+worker_collector = None
+
+
+def split_pages(total_page_num, pages_per_shard):
+    '''
+    按页切分
+    :param total_page_num: 总页数
+    :param pages_per_shard: 每个分片的页数
+    :return: 页码列表的列表，如 [[1, 2], [3]]
+    '''
+    pages = list(range(1, total_page_num + 1))
+    return [pages[i:i + pages_per_shard] for i in range(0, len(pages), pages_per_shard)]
+
+
+class JsonLinesSink:
+    '''
+    分片结果文件，每行一条记录
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False))
+            self.file.write('\n')
+        self.count += len(records)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_sinks(paths):
+    '''
+    按顺序读取分片结果文件
+    :param paths: 结果文件路径列表
+    :return: 记录生成器
+    '''
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def init_worker(collector):
+    '''
+    子进程初始化，保存采集对象
+    :param collector: 采集对象
+    :return:
+    '''
+    global worker_collector
+    worker_collector = collector
+
+
+def run_shard(job):
+    '''
+    在子进程中执行单个分片
+    :param job: (区域ID, 页码列表, 结果文件路径)
+    :return: (结果文件路径, 记录数, 失败的请求)
+    '''
+    region, pages, path = job
+    return worker_collector.collect_shard(region, pages, path)
+
+
+def run_shards(collector, shards, name, processes=None, sink_dir=None):
+    '''
+    多进程执行所有分片
+    :param collector: 采集对象，需实现 collect_shard(region, pages, path)，返回 (结果文件路径, 记录数, 失败的请求)
+    :param shards: [(区域ID, 页码列表)]
+    :param name: 资源名称，用于结果文件命名
+    :param processes: 进程数，默认为CPU核数
+    :param sink_dir: 结果文件目录，默认为新建的临时目录
+    :return: 结果文件路径列表，与分片顺序一致；所有分片完成后如有请求失败，抛出 CollectError
+    '''
+    sink_dir = sink_dir or tempfile.mkdtemp(prefix=name + '-')
+    os.makedirs(sink_dir, exist_ok=True)
+    jobs = [
+        (region, pages, os.path.join(sink_dir, '%s-%s-%d.jsonl' % (name, region, pages[0])))
+        for region, pages in shards
+    ]
+    paths = []
+    total = 0
+    failures = []
+    with Pool(processes or cpu_count(), init_worker, (collector,)) as pool:
+        for path, count, shard_failures in pool.imap(run_shard, jobs):
+            paths.append(path)
+            total += count
+            failures.extend(shard_failures)
+    logger.info('%s: %d records in %d shards, %s', name, total, len(paths), sink_dir)
+    if failures:
+        raise CollectError(failures)
+    return paths
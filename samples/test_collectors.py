@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : test_collectors
+# @Software       : PyCharm
+
+'''
+采集类测试，使用 benchmark_concurrency.MockApi 模拟接口，不访问阿里云
+
+运行：
+pytest samples
+'''
+
+import gc
+import os
+import json
+import time
+import logging
+import pickle
+
+import pytest
+
+pytest.importorskip('aliyunsdkcore')
+
+from settings import Settings
+from get_all_ecs import ECS, ECS_MAPPING
+from get_all_rds import RDS, RDS_MAPPING
+from errors import CollectError
+from field_mapping import Field, Mapping
+from response_cache import ResponseCache
+from sharding import read_sinks
+from benchmark_concurrency import MockApi
+
+
+def mock_settings(max_workers, api=None):
+    # 页大小取小值，使每个区域有多页；每次请求随机延迟，打乱并发完成顺序
+    api = api or MockApi(regions=6, per_region=120, latency=0, item_latency=0, jitter=0.005)
+    return Settings(max_workers=max_workers, page_size={'ecs': 10, 'disk': 10, 'rds': 10}, client_factory=api)
+
+
+def collect(cls, method, settings):
+    collector = cls(settings=settings)
+    collector.get_region()
+    return getattr(collector, method)()
+
+
+@pytest.mark.parametrize('cls, method', [
+    (ECS, 'get_ecs'),
+    (ECS, 'get_disk'),
+    (RDS, 'get_rds'),
+])
+def test_concurrent_output_matches_serial(cls, method):
+    serial = collect(cls, method, mock_settings(1))
+    concurrent = collect(cls, method, mock_settings(64))
+    assert len(serial) > 0
+    assert concurrent == serial
+
+
+def test_concurrent_output_is_stable():
+    results = [collect(ECS, 'get_ecs', mock_settings(64)) for _ in range(3)]
+    assert results[0] == results[1] == results[2]
+
+
+class FailingApi(MockApi):
+    '''
+    指定区域的指定页请求失败
+    '''
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def fail(self, region, page):
+        if (region, int(page)) in self.failures:
+            raise RuntimeError('mock failure')
+
+    def action_DescribeInstances(self, region, params):
+        self.fail(region, params['PageNumber'])
+        return super().action_DescribeInstances(region, params)
+
+    def action_DescribeDBInstances(self, region, params):
+        self.fail(region, params['PageNumber'])
+        return super().action_DescribeDBInstances(region, params)
+
+
+FAILURES = [('mock-region-1', 1), ('mock-region-3', 2)]
+
+
+@pytest.mark.parametrize('cls, method', [
+    (ECS, 'get_ecs'),
+    (RDS, 'get_rds'),
+])
+def test_failed_pages_are_reported(cls, method):
+    api = FailingApi(FAILURES, regions=6, per_region=120, latency=0, item_latency=0)
+    with pytest.raises(CollectError) as e:
+        collect(cls, method, mock_settings(8, api))
+    assert e.value.failures == FAILURES
+
+
+@pytest.mark.parametrize('cls, method, sharded', [
+    (ECS, 'get_ecs', 'get_ecs_sharded'),
+    (RDS, 'get_rds', 'get_rds_sharded'),
+])
+def test_sharded_output_matches_serial(tmp_path, cls, method, sharded):
+    expected = collect(cls, method, mock_settings(1))
+    collector = cls(settings=mock_settings(8))
+    collector.get_region()
+    paths = getattr(collector, sharded)(processes=2, sink_dir=str(tmp_path))
+    assert list(read_sinks(paths)) == expected
+
+
+def test_sharded_collector_state_is_small():
+    rds = RDS(settings=mock_settings(8))
+    rds.get_region()
+    rds.get_rds()
+    state = pickle.loads(pickle.dumps(rds))
+    assert rds.regionList and rds.instance_ids_list
+    assert state.regionList == [] and state.instance_ids_list == []
+
+
+def test_failed_pages_are_reported_when_sharded(tmp_path):
+    api = FailingApi([('mock-region-3', 2)], regions=6, per_region=120, latency=0, item_latency=0)
+    ecs = ECS(settings=mock_settings(8, api))
+    ecs.get_region()
+    with pytest.raises(CollectError) as e:
+        ecs.get_ecs_sharded(processes=2, sink_dir=str(tmp_path))
+    assert e.value.failures == [('mock-region-3', 2)]
+
+
+def ecs_record(**changes):
+    record = MockApi().action_DescribeInstances('r', {'PageSize': 1, 'PageNumber': 1})[0]['Instances']['Instance'][0]
+    for key, value in changes.items():
+        if value is None:
+            del record[key]
+        else:
+            record[key] = value
+    return record
+
+
+def test_missing_optional_key_keeps_the_rest_of_the_record():
+    expected = ECS_MAPPING.translate(ecs_record())
+    result, misses = ECS_MAPPING.extract(ecs_record(PublicIpAddress=None))
+    assert 'public_ip' not in result
+    assert misses == []
+    del expected['public_ip']
+    assert result == expected
+
+
+def test_missing_required_key_is_reported_per_field():
+    expected = ECS_MAPPING.translate(ecs_record())
+    result, misses = ECS_MAPPING.extract(ecs_record(HostName=None, Memory='4096MB'))
+    assert misses == ['hostname', 'memory']
+    assert result['hostname'] is None
+    assert result['memory'] is None
+    assert result['specs']['memory'] == '4096MB'
+    # 其他字段照常翻译，字段顺序不变
+    assert list(result) == list(expected)
+    assert dict((k, v) for k, v in result.items() if k not in ('hostname', 'memory', 'specs')) == \
+        dict((k, v) for k, v in expected.items() if k not in ('hostname', 'memory', 'specs'))
+
+
+MAPPING = Mapping([
+    Field('name', 'Name', required=True),
+    Field('ip', 'Nics.Nic.0.Ip', required=True),
+    Field('second_ip', 'Nics.Nic.1.Ip', default='none'),
+    Field('size', 'Size', default=-1, coerce=int),
+    Field('tags', 'Tags.Tag', omit_empty=True),
+    Field('kind', value='vm'),
+    Field('specs.cpu', 'Cpu', required=True),
+    Field('specs.gpu', 'Gpu', omit_empty=True),
+], key='Name')
+
+
+def test_nested_paths_and_list_indexes():
+    result, misses = MAPPING.extract({
+        'Name': 'a', 'Nics': {'Nic': [{'Ip': '10.0.0.1'}, {'Ip': '10.0.0.2'}]}, 'Size': '40', 'Tags': {'Tag': ['t']},
+        'Cpu': 2, 'Gpu': 1,
+    })
+    assert misses == []
+    assert result == {'name': 'a', 'ip': '10.0.0.1', 'second_ip': '10.0.0.2', 'size': 40, 'tags': ['t'],
+                      'kind': 'vm', 'specs': {'cpu': 2, 'gpu': 1}}
+    # 列表长度不足、中间层级类型不符时视为缺失
+    for nics in ({'Nic': [{'Ip': '10.0.0.1'}]}, {'Nic': [{'Ip': '10.0.0.1'}], 'Other': []}):
+        result, misses = MAPPING.extract({'Name': 'a', 'Nics': nics, 'Cpu': 2})
+        assert result['ip'] == '10.0.0.1' and result['second_ip'] == 'none' and misses == []
+    for nics in ({'Nic': []}, {'Nic': {}}, [], 'x', None):
+        result, misses = MAPPING.extract({'Name': 'a', 'Nics': nics, 'Cpu': 2})
+        assert result['ip'] is None and result['second_ip'] == 'none' and misses == ['ip']
+
+
+def test_default_is_used_when_coerce_fails():
+    for size in ('forty', None, [1]):
+        result, misses = MAPPING.extract({'Name': 'a', 'Nics': {'Nic': [{'Ip': 'x'}]}, 'Size': size, 'Cpu': 1})
+        assert result['size'] == -1
+        assert misses == []
+    assert MAPPING.extract({'Size': 'forty'})[1] == ['name', 'ip', 'specs.cpu']
+
+
+def test_omit_empty():
+    base = {'Name': 'a', 'Nics': {'Nic': [{'Ip': 'x'}]}, 'Cpu': 1}
+    for tags in ({'Tag': []}, {'Tag': ''}, {}, None):
+        record = dict(base, Tags=tags)
+        result, misses = MAPPING.extract(record)
+        assert 'tags' not in result and misses == []
+    assert 'tags' not in MAPPING.extract(base)[0]
+    assert MAPPING.extract(dict(base, Tags={'Tag': ['t']}))[0]['tags'] == ['t']
+    # 省略的字段不改变其他字段的顺序，所有子字段都被省略时不输出父字段
+    assert list(MAPPING.extract(base)[0]) == ['name', 'ip', 'second_ip', 'size', 'kind', 'specs']
+    assert MAPPING.extract(base)[0]['specs'] == {'cpu': 1}
+    gpu_only = Mapping([Field('name', 'Name'), Field('specs.gpu', 'Gpu', omit_empty=True)])
+    assert gpu_only.extract({'Name': 'a'})[0] == {'name': 'a'}
+    assert gpu_only.extract({'Name': 'a', 'Gpu': 2})[0] == {'name': 'a', 'specs': {'gpu': 2}}
+
+
+def test_batch_reports_misses_once(caplog):
+    records = [
+        {'Name': 'a', 'Nics': {'Nic': [{'Ip': 'x'}]}, 'Cpu': 1},
+        {'Name': 'b', 'Cpu': 1},
+        {'Cpu': 1},
+        'not a record',
+    ]
+    with caplog.at_level(logging.WARNING):
+        results = MAPPING.translate_batch(records)
+    assert results == [MAPPING.extract(record)[0] for record in records]
+    assert results[0]['ip'] == 'x' and results[1]['name'] == 'b'
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert warnings == ['missing fields in 4 records: ip(3), name(2), specs.cpu(1)']
+
+
+def test_mapping_fingerprint_follows_fields():
+    fields = [Field('cpu', 'Cpu', coerce=int), Field('memory', 'Memory', default=0)]
+    fingerprint = Mapping(fields).fingerprint
+    assert Mapping(fields).fingerprint == fingerprint
+    assert Mapping(fields[:1]).fingerprint != fingerprint
+    assert Mapping([Field('cpu', 'Cpu', coerce=str), fields[1]]).fingerprint != fingerprint
+    assert Mapping([Field('cpu', 'Cpu', coerce=lambda v: int(v) * 2), fields[1]]).fingerprint != \
+        Mapping([Field('cpu', 'Cpu', coerce=lambda v: int(v) * 4), fields[1]]).fingerprint
+
+
+def test_disk_cache_matches_uncached(tmp_path):
+    expected = collect(ECS, 'get_ecs', mock_settings(8))
+    for _ in range(2):
+        ecs = ECS(cache=ResponseCache(cache_dir=str(tmp_path)), settings=mock_settings(8))
+        ecs.get_region()
+        assert ecs.get_ecs() == expected
+    assert all(name.endswith('.json') for name in os.listdir(str(tmp_path)))
+
+
+@pytest.mark.parametrize('persist', [False, True])
+def test_cached_results_are_not_shared_with_callers(tmp_path, persist):
+    settings = mock_settings(8)
+    cache = ResponseCache(cache_dir=str(tmp_path) if persist else None)
+    ecs = ECS(cache=cache, settings=settings)
+    ecs.get_region()
+    expected = ecs.get_ecs()
+    for instances in (expected, ecs.get_ecs()):
+        instances[0]['hostname'] = 'MUTATED'
+        instances[0]['specs']['name'] = 'MUTATED'
+    disks = ecs.get_disk()
+    disks[0]['Size'] = -1
+    # 再次请求时内容未变化的页会重新写入磁盘缓存
+    ecs.get_ecs()
+    ecs.get_disk()
+    if persist:
+        cache = ResponseCache(cache_dir=str(tmp_path))
+    ecs = ECS(cache=cache, settings=settings)
+    ecs.get_region()
+    assert ecs.get_ecs() == collect(ECS, 'get_ecs', settings)
+    assert ecs.get_disk() == collect(ECS, 'get_disk', settings)
+
+
+class ProductClient:
+    '''
+    返回请求所属产品的连接，用于区分不同产品的同名接口
+    '''
+
+    def get_region_id(self):
+        return 'cn-hangzhou'
+
+    def get_access_key(self):
+        return 'mock'
+
+    def do_action_with_exception(self, request):
+        return json.dumps({'Product': request.get_product(), 'Version': request.get_version()}).encode('utf-8')
+
+
+def test_cache_key_includes_product_and_version():
+    from aliyunsdkecs.request.v20140526.DescribeRegionsRequest import DescribeRegionsRequest as EcsRegions
+    from aliyunsdkrds.request.v20140815.DescribeRegionsRequest import DescribeRegionsRequest as RdsRegions
+    cache = ResponseCache()
+    client = ProductClient()
+    ecs = cache.fetch(EcsRegions(), client).data
+    rds = cache.fetch(RdsRegions(), client).data
+    assert ecs == {'Product': 'Ecs', 'Version': '2014-05-26'}
+    assert rds == {'Product': 'Rds', 'Version': '2014-08-15'}
+
+
+def legacy_ecs_translate(ins):
+    # 改用 Mapping 之前 ECS.translate 的实现，作为翻译速度的基准
+    instrance = {}
+    instrance['disk'] = 0
+    instrance['hostname'] = ins['HostName']
+    if ins.get('NetworkInterfaces'):
+        instrance['host_ip'] = ins['NetworkInterfaces']['NetworkInterface'][0]['PrimaryIpAddress']
+    if ins['PublicIpAddress'].get('IpAddress'):
+        instrance['public_ip'] = ins['PublicIpAddress'].get('IpAddress', '')[0]
+    if ins.get('NetworkInterfaces'):
+        instrance['mac'] = ins['NetworkInterfaces']['NetworkInterface'][0]['MacAddress']
+    instrance['os'] = ins['OSNameEn']
+    instrance['cpu'] = ins['Cpu']
+    instrance['memory'] = int(ins['Memory'] / 1024)
+    instrance['sn'] = ins['SerialNumber']
+    instrance['instance_id'] = ins['InstanceId']
+    instrance['instance_name'] = ins['InstanceName']
+    instrance['create_time'] = ins['CreationTime']
+    instrance['expiration_time'] = ins['ExpiredTime']
+    instrance['zone'] = ins['ZoneId']
+    instrance['region'] = ins['RegionId']
+    instrance['status'] = ins['Status']
+    instrance['power_state'] = 'poweredOff' if ins['Status'] != 'Running' else 'poweredOn'
+    instrance['ostype'] = ins['OSType']
+    instrance['instancechargetype'] = ins['InstanceChargeType']
+    instrance['internetchargetype'] = ins['InternetChargeType']
+    instrance['salecycle'] = ins.get('SaleCycle', '')
+    instrance['comment'] = ins.get('Description', '')
+    instrance['specs'] = {
+        'name': ins['InstanceType'],
+        'family': ins['InstanceTypeFamily'],
+        'cpu': ins['Cpu'],
+        'memory': ins['Memory']
+    }
+    return instrance
+
+
+def legacy_rds_translate(ins):
+    # 改用 Mapping 之前 RDS.translate 的实现，作为翻译速度的基准
+    instrance = {}
+    instrance['instance_id'] = ins['DBInstanceId']
+    for target, key in (('instance_name', 'DBInstanceDescription'), ('instance_type', 'DBInstanceType'),
+                        ('instancenet_type', 'DBInstanceNetType'), ('vpc_cloud_instance_id', 'VpcCloudInstanceId'),
+                        ('vpc_id', 'VpcId'), ('connection_mode', 'ConnectionMode'), ('vswitch_id', 'VSwitchId'),
+                        ('host_address', 'ConnectionString'), ('port', 'Port'), ('engine', 'Engine'),
+                        ('engine_version', 'EngineVersion'), ('status', 'DBInstanceStatus'), ('lock_mode', 'LockMode')):
+        instrance[target] = ins.get(key)
+    if ins.get('LockReason'):
+        instrance['lock_reason'] = ins.get('LockReason')
+    instrance['resource_group_id'] = ins.get('ResourceGroupId')
+    instrance['zone'] = ins.get('ZoneId')
+    instrance['region'] = ins.get('RegionId')
+    instrance['category'] = ins.get('Category')
+    if ins.get('TimeZone'):
+        instrance['timezone'] = ins.get('TimeZone')
+    instrance['instancechargetype'] = ins.get('PayType')
+    instrance['comment'] = ins.get('DBInstanceDescription')
+    if ins['ReadOnlyDBInstanceIds'].get('ReadOnlyDBInstanceId'):
+        instrance['readonly_ins'] = ins['ReadOnlyDBInstanceIds'].get('ReadOnlyDBInstanceId')
+    instrance['maintain_time'] = ins.get('MaintainTime')
+    instrance['create_time'] = ins.get('CreationTime')
+    instrance['expiration_time'] = ins.get('ExpireTime')
+    instrance['cpu'] = ins.get('DBInstanceCPU')
+    instrance['memory'] = int(ins.get('DBInstanceMemory')) / 1024
+    instrance['disk'] = ins['DBInstanceStorage']
+    instrance['specs'] = {
+        'name': ins['DBInstanceClass'],
+        'family': ins['DBInstanceClassType'],
+        'cpu': instrance['cpu'],
+        'memory': instrance['memory'],
+        'max_conn': ins['MaxConnections'],
+        'max_iops': ins['MaxIOPS'],
+        'db_max_quantity': ins['DBMaxQuantity'],
+        'account_max_quantity': ins['AccountMaxQuantity']
+    }
+    return instrance
+
+
+def best_times(funcs, repeat=15):
+    '''
+    交替执行，分别取最好成绩，执行期间暂停垃圾回收，减少机器负载造成的波动
+    '''
+    best = [float('inf')] * len(funcs)
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for i, func in enumerate(funcs):
+                start = time.perf_counter()
+                func()
+                best[i] = min(best[i], time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+@pytest.mark.parametrize('mapping, legacy, records', [
+    (ECS_MAPPING, legacy_ecs_translate,
+     lambda api: api.action_DescribeInstances('r', {'PageSize': 5000, 'PageNumber': 1})[0]['Instances']['Instance']),
+    (RDS_MAPPING, legacy_rds_translate,
+     lambda api: [api.action_DescribeDBInstanceAttribute('r', {'DBInstanceId': 'rm-r-%d' % i})[0]['Items'][
+         'DBInstanceAttribute'][0] for i in range(5000)]),
+])
+def test_mapping_is_as_fast_as_legacy_translate(mapping, legacy, records):
+    records = records(MockApi(per_region=5000))
+    assert mapping.translate_batch(records) == [legacy(record) for record in records]
+    # 按最好成绩比较，并留出余量，避免机器负载造成误报
+    legacy_time, mapping_time = best_times([
+        lambda: [legacy(record) for record in records],
+        lambda: mapping.translate_batch(records),
+    ])
+    assert mapping_time < legacy_time * 1.5
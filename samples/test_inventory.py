@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Author         : Eric Winn
+# @Email          : eng.eric.winn@gmail.com
+# @Time           : 2019/11/11 1:49 PM
+# @Version        : 1.0
+# @File           : test_inventory
+# @Software       : PyCharm
+
+'''
+本地资产库测试
+
+运行：
+pytest samples
+'''
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from inventory import Inventory, normalize_time
+from sharding import JsonLinesSink
+
+
+def ecs(index, expires='2020-06-01T16:00Z', **fields):
+    record = {
+        'instance_id': 'i-%d' % index,
+        'hostname': 'host-%d' % index,
+        'host_ip': '10.0.0.%d' % index,
+        'mac': '00:16:3e:00:00:%02x' % index,
+        'region': 'cn-hangzhou',
+        'status': 'Running',
+        'expiration_time': expires,
+        'specs': {'name': 'ecs.g5.large'},
+    }
+    record.update(fields)
+    return record
+
+
+def rds(index, expires='2020-06-01T16:00:00Z'):
+    return {
+        'instance_id': 'rm-%d' % index,
+        'host_address': 'rm-%d.mysql.rds.aliyuncs.com' % index,
+        'region': 'cn-hangzhou',
+        'status': 'Running',
+        'expiration_time': expires,
+        'specs': {'name': 'rds.mysql.s2.large'},
+    }
+
+
+def ids(records):
+    return [record.get('instance_id', record.get('domain_id')) for record in records]
+
+
+def test_replace_removes_released_resources():
+    inventory = Inventory()
+    inventory.replace('ecs', [ecs(1), ecs(2)])
+    inventory.replace('rds', [rds(1)])
+    assert inventory.replace('ecs', [ecs(1)]) == 1
+    assert inventory.get('ecs', 'i-2') is None
+    assert sorted(ids(inventory.expiring('2020-07-01'))) == ['i-1', 'rm-1']
+    assert inventory.by_address('10.0.0.2') == []
+    assert inventory.by_address('00:16:3e:00:00:02') == []
+    # 其他类型的资源不受影响
+    assert inventory.count('rds') == 1
+
+
+def test_replace_moves_reused_address_to_new_resource():
+    inventory = Inventory()
+    inventory.replace('ecs', [ecs(1), ecs(2)])
+    # i-2 释放后其IP分配给了新建的 i-3
+    inventory.replace('ecs', [ecs(1), ecs(3, host_ip='10.0.0.2')])
+    assert ids(inventory.by_address('10.0.0.2')) == ['i-3']
+
+
+def test_add_keeps_existing_resources():
+    inventory = Inventory()
+    inventory.add('ecs', [ecs(1), ecs(2)])
+    inventory.add('ecs', [ecs(1, host_ip='10.0.0.9')])
+    assert inventory.count('ecs') == 2
+    assert inventory.by_address('10.0.0.1') == []
+    assert ids(inventory.by_address('10.0.0.9')) == ['i-1']
+
+
+def domain(index, expires='2021-01-02 00:00:00'):
+    return {'name': 'example-%d.com' % index, 'domain_id': 'S%d' % index, 'domain_status': 1,
+            'expiration_date': expires}
+
+
+@pytest.mark.parametrize('value, expected', [
+    # ECS 到期时间精确到分钟，补齐秒
+    ('2020-06-01T16:00Z', '2020-06-01T16:00:00Z'),
+    ('2020-06-01T16:00:00Z', '2020-06-01T16:00:00Z'),
+    # 域名到期时间为北京时间
+    ('2021-01-02 00:00:00', '2021-01-01T16:00:00Z'),
+    ('2021-01-02 08:30:00', '2021-01-02T00:30:00Z'),
+    ('2021-01-02', '2021-01-01T16:00:00Z'),
+    (datetime(2020, 6, 1, 16, 0), '2020-06-01T16:00:00Z'),
+    ('', None),
+    (None, None),
+    ('next year', None),
+])
+def test_normalize_time(value, expected):
+    assert normalize_time(value) == expected
+
+
+@pytest.fixture
+def inventory():
+    inventory = Inventory()
+    inventory.replace('ecs', [
+        ecs(1, '2020-06-01T15:59Z'),
+        ecs(2, '2020-06-01T16:00Z', public_ip='47.0.0.2'),
+        ecs(3, '2020-06-01T16:01Z', region='cn-beijing', status='Stopped'),
+        ecs(4, '2020-07-01T16:00Z', specs={'name': 'ecs.c5.xlarge'}),
+    ])
+    inventory.replace('rds', [rds(1, '2020-06-01T16:00:00Z'), rds(2, '2020-08-01T16:00:00Z')])
+    # 北京时间 2020-06-02 00:00 即 UTC 2020-06-01 16:00
+    inventory.replace('domain', [domain(1, '2020-06-02 00:00:00'), domain(2, '2020-06-02 00:00:01')])
+    yield inventory
+    inventory.close()
+
+
+def test_expiring_range_is_inclusive(inventory):
+    # i-2、rm-1、S1 到期时间相同，均在 UTC 2020-06-01 16:00
+    at = '2020-06-01T16:00:00Z'
+    expiring = ids(inventory.expiring(at))
+    assert expiring[0] == 'i-1'
+    assert sorted(expiring[1:]) == ['S1', 'i-2', 'rm-1']
+    assert sorted(ids(inventory.expiring(at, after=at))) == ['S1', 'i-2', 'rm-1']
+    assert ids(inventory.expiring('2020-06-01T16:00:59Z', after='2020-06-01T16:00:01Z')) == ['S2']
+    assert ids(inventory.expiring(datetime(2020, 6, 1, 16, 1)))[-2:] == ['S2', 'i-3']
+    assert ids(inventory.expiring('2020-05-31')) == []
+
+
+def test_expiring_by_kind(inventory):
+    assert ids(inventory.expiring('2020-06-01T16:00:00Z', kind='ecs')) == ['i-1', 'i-2']
+    assert ids(inventory.expiring('2020-12-31', after='2020-06-01T16:00:01Z', kind='rds')) == ['rm-2']
+    assert ids(inventory.expiring('2020-06-02 00:00:00', kind='domain')) == ['S1']
+    assert ids(inventory.expiring('2020-12-31', kind='domain')) == ['S1', 'S2']
+
+
+def test_expiring_in():
+    now = datetime.utcnow()
+    inventory = Inventory()
+    inventory.replace('ecs', [
+        ecs(1, (now - timedelta(days=1)).strftime('%Y-%m-%dT%H:%MZ')),
+        ecs(2, (now + timedelta(days=1)).strftime('%Y-%m-%dT%H:%MZ')),
+        ecs(3, (now + timedelta(days=29)).strftime('%Y-%m-%dT%H:%MZ')),
+        ecs(4, (now + timedelta(days=31)).strftime('%Y-%m-%dT%H:%MZ')),
+    ])
+    inventory.replace('rds', [rds(1, (now + timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ'))])
+    assert ids(inventory.expiring_in(30)) == ['i-2', 'rm-1', 'i-3']
+    assert ids(inventory.expiring_in(30, kind='ecs')) == ['i-2', 'i-3']
+    assert ids(inventory.expiring_in(1, kind='rds')) == []
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({}, ['i-1', 'i-2', 'i-3', 'i-4', 'rm-1', 'rm-2', 'S1', 'S2']),
+    ({'kind': 'ecs'}, ['i-1', 'i-2', 'i-3', 'i-4']),
+    ({'region': 'cn-beijing'}, ['i-3']),
+    ({'status': 'Running'}, ['i-1', 'i-2', 'i-4', 'rm-1', 'rm-2']),
+    ({'kind': 'ecs', 'status': 'Running', 'instance_type': 'ecs.g5.large'}, ['i-1', 'i-2']),
+    ({'region': 'cn-hangzhou', 'instance_type': 'rds.mysql.s2.large'}, ['rm-1', 'rm-2']),
+    ({'instance_type': 'ecs.c5.xlarge'}, ['i-4']),
+    # 域名状态为数字
+    ({'kind': 'domain', 'status': 1}, ['S1', 'S2']),
+    ({'kind': 'rds', 'region': 'cn-beijing'}, []),
+])
+def test_find(inventory, query, expected):
+    assert sorted(ids(inventory.find(**query))) == sorted(expected)
+
+
+def test_by_address(inventory):
+    assert ids(inventory.by_address('10.0.0.2')) == ['i-2']
+    assert ids(inventory.by_address('47.0.0.2')) == ['i-2']
+    assert ids(inventory.by_address('00:16:3e:00:00:03')) == ['i-3']
+    assert ids(inventory.by_address('rm-2.mysql.rds.aliyuncs.com')) == ['rm-2']
+    assert inventory.by_address('10.0.0.99') == []
+
+
+def test_load_sinks(tmp_path):
+    paths = []
+    for shard, records in enumerate(([ecs(1), ecs(2)], [ecs(3)], [])):
+        path = os.path.join(str(tmp_path), 'ecs-%d.jsonl' % shard)
+        with JsonLinesSink(path) as sink:
+            sink.write(records)
+        paths.append(path)
+    inventory = Inventory(os.path.join(str(tmp_path), 'inventory.db'))
+    inventory.add('ecs', [ecs(9)])
+    assert inventory.load_sinks('ecs', paths) == 3
+    assert inventory.count('ecs') == 3
+    assert inventory.get('ecs', 'i-2') == ecs(2)
+    assert inventory.get('ecs', 'i-9') is None
+    assert ids(inventory.by_address('10.0.0.3')) == ['i-3']
+    inventory.close()
+
+    # 文件中的数据在重新打开后仍然存在
+    inventory = Inventory(os.path.join(str(tmp_path), 'inventory.db'))
+    assert sorted(ids(inventory.find(kind='ecs'))) == ['i-1', 'i-2', 'i-3']
+    inventory.close()